@@ -0,0 +1,118 @@
+"""
+Benchmark of HtmlParser (scrape method) over corpus of saved entry pages.
+
+    python benchmarks/bench_parsers.py [--corpus DIR] [--repeat N] [--html-parser NAME]
+
+DIR - directory with saved entry pages named <entry_id>.html (e.g. saved from
+https://www.wykop.pl/wpis/<entry_id>/), without it synthetic pages are generated.
+Per-entry cost of get_main_entry() is compared with the old implementation which
+parsed main entry twice, api entry body parsing is compared between BODY_PARSERS.
+Pages are parsed by --html-parser (default: settings.HTML_PARSER).
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(os.path.abspath(__file__)))))
+
+from taktyk import settings
+from taktyk.parsers import BODY_PARSERS, HtmlParser, get_bs4_features
+
+SOUP_F = '''<div class="wblock lcontrast dC" data-id="{id_}" data-type="entry">
+    <a class="color-1 showProfileSummary" href="https://www.wykop.pl/ludzie/user{id_}/"><b>user{id_}</b></a>
+    <time title="2018-05-05 21:36:47" pubdate=""></time>
+    <p class="vC" data-vc="{id_}" data-vcp="0" data-vcm="0"></p>
+    <div class="text"><p>Text {id_} <a class="showSpoiler">pokaż spoiler</a> {body}
+    #<a class="showTagSummary" href="https://www.wykop.pl/tag/python">python</a></p>
+    <div class="media-content"><a href="https://www.test-url.pl/{id_}.jpg"> </a></div></div></div>'''
+BODY = 'lorem ipsum <a href="https://www.wykop.pl/ludzie/someone/">@someone</a> ' * 20
+JSON_BODY = ' '.join('#<a href="#tag{0}">tag{0}</a> @<a href="@user{0}">user{0}</a> lorem &amp; '
+                     'ipsum<br />'.format(i) for i in range(30))
+
+
+class DoubleParseHtmlParser(HtmlParser):
+    """get_main_entry() as it was before - main entry soup parsed twice"""
+    def get_main_entry(self):
+        if self.soup_list:
+            self.EntryParserHelper(self.id_, self.soup_list[0]).parse()
+            parser = self.EntryParserHelper(self.id_, self.soup_list[0])
+            if parser.entry.id_:
+                return parser.parse()
+            return None
+
+
+def gen_synthetic_corpus(count=200, comments=20):
+    for id_ in range(1, count + 1):
+        comments_html = ''.join('<li>{}</li>'.format(SOUP_F.format(id_=id_ * 1000 + i, body=BODY))
+                                for i in range(comments))
+        page = '<html><body><ul><li class="entry">{}<ul>{}</ul></li></ul></body></html>'
+        yield str(id_), page.format(SOUP_F.format(id_=id_, body=BODY), comments_html)
+
+
+def gen_corpus(path):
+    for file_name in sorted(os.listdir(path)):
+        id_, ext = os.path.splitext(file_name)
+        if ext in ('.html', '.htm') and id_.isdigit():
+            with open(os.path.join(path, file_name), 'rb') as file:
+                yield id_, file.read()
+
+
+def parse_entry(parser_cls, id_, html):
+    parser = parser_cls(id_, html)
+    return [parser.get_main_entry()] + list(parser.get_comments_generator(1))
+
+
+def bench_main_entry(parser_cls, corpus, repeat):
+    """Best time of get_main_entry() for whole corpus (soups are built beforehand)"""
+    times = []
+    for _ in range(repeat):
+        parsers = [parser_cls(id_, html) for id_, html in corpus]
+        times.append(timeit.timeit(lambda: [parser.get_main_entry() for parser in parsers],
+                                   number=1))
+    return min(times)
+
+
+def bench_whole_entry(parser_cls, corpus, repeat):
+    """Best time of building soup and parsing main entry with all comments for whole corpus"""
+    return min(timeit.repeat(lambda: [parse_entry(parser_cls, *raw) for raw in corpus],
+                             number=1, repeat=repeat))
+
+
+def bench_json_body(body_parser, repeat, number=200):
+    """Best time of parsing one api entry body (JsonParser._parse_body_and_tags) by body_parser"""
+    return min(timeit.repeat(lambda: body_parser(JSON_BODY), number=number, repeat=repeat)) / number
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='HtmlParser benchmark')
+    arg_parser.add_argument('--corpus', help='directory with saved entry pages (<id>.html)')
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    arg_parser.add_argument('--html-parser', help='bs4 tree builder (settings.HTML_PARSER)')
+    args = arg_parser.parse_args()
+    settings.HTML_PARSER = args.html_parser or settings.HTML_PARSER
+
+    corpus = list(gen_corpus(args.corpus) if args.corpus else gen_synthetic_corpus())
+    if not corpus:
+        sys.exit('No <entry_id>.html files in {}'.format(args.corpus))
+
+    assert ([str(e) for e in parse_entry(HtmlParser, *corpus[0])] ==
+            [str(e) for e in parse_entry(DoubleParseHtmlParser, *corpus[0])])
+
+    print('entries: {}, bs4 tree builder: {}'.format(len(corpus), get_bs4_features()))
+    for name, bench in (('get_main_entry', bench_main_entry), ('whole entry', bench_whole_entry)):
+        old = bench(DoubleParseHtmlParser, corpus, args.repeat)
+        new = bench(HtmlParser, corpus, args.repeat)
+        print('{:<16} old: {:8.3f} ms/entry   new: {:8.3f} ms/entry   speedup: {:.2f}x'.format(
+            name, old * 1000 / len(corpus), new * 1000 / len(corpus), old / new))
+
+    assert BODY_PARSERS['bs4'](JSON_BODY) == BODY_PARSERS['tokenizer'](JSON_BODY)
+    times = {name: bench_json_body(body_parser, args.repeat)
+             for name, body_parser in BODY_PARSERS.items()}
+    for name, body_time in sorted(times.items()):
+        print('json body {:<10} {:8.3f} ms/entry   speedup: {:.2f}x'.format(
+            name, body_time * 1000, times['bs4'] / body_time))
+
+
+if __name__ == '__main__':
+    main()
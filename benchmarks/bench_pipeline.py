@@ -0,0 +1,293 @@
+"""
+Benchmark of fetch -> parse -> store pipeline, html export and media downloads.
+
+    python benchmarks/bench_pipeline.py [--sizes 100,1000] [--scenarios api,scrape,html,download]
+                                        [--fixtures DIR] [--output FILE] [--baseline FILE]
+
+Wykop is replaced by local http server serving api pages/entries, entry pages and media files.
+Entries are synthetic or recorded fixtures from DIR: api/<entry_id>.json (api entry json with
+comments) and html/<entry_id>.html (page saved from https://www.wykop.pl/i/wpis/<entry_id>/),
+size is number of entries (at most number of fixtures).
+
+Scenarios:
+    api      - pipeline(APIStrategy, APIMethod), files skipped
+    scrape   - pipeline(SourceStrategy, ScrapeMethod), files skipped
+    html     - HtmlFile.create() of database filled by api scenario
+    download - Multi downloads of files of entries saved by api scenario
+
+Every scenario x size is run in a fresh process, so peak RSS (kB, parse processes included)
+is measured per run. Results are printed and written to FILE as json. With --baseline
+(results written before) the program exits with status 1 when entries/s of any run dropped
+by more than --tolerance.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(os.path.abspath(__file__)))))
+
+import taktyk
+from bench_parsers import BODY, JSON_BODY, gen_corpus, gen_synthetic_corpus
+from taktyk import settings
+from taktyk.commands.script_commands import CreateFolders
+from taktyk.db import DB
+from taktyk.entrygenerators import APIMethod, ScrapeMethod
+from taktyk.render import HtmlFile
+from taktyk.save import Multi, save_wrapper
+from taktyk.strategies import APIStrategy, SourceStrategy
+
+SCENARIOS = ('api', 'scrape', 'html', 'download')
+API_PAGE_SIZE = 25
+COMMENTS = 10
+MEDIA_SIZE = 64 * 1024
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves server.fixtures - /api/page/<n>, /api/entry/<id>, /html/<id>, /media/<id>.jpg"""
+    protocol_version = 'HTTP/1.1'  # keep-alive like real servers
+
+    def do_GET(self):
+        fixtures = self.server.fixtures
+        _, kind, *path = self.path.split('/')
+        body = None
+        if kind == 'api' and path[0] == 'page':
+            page = int(path[1])
+            entries = fixtures.api_ids[(page - 1) * API_PAGE_SIZE:page * API_PAGE_SIZE]
+            body = '[{}]'.format(','.join(fixtures.api[id_] for id_ in entries)).encode('utf-8')
+        elif kind == 'api' and path[0] in fixtures.api:
+            body = fixtures.api[path[0]].encode('utf-8')
+        elif kind == 'html' and path[0] in fixtures.html:
+            body = fixtures.html[path[0]]
+        elif kind == 'media':
+            body = fixtures.media
+        if body is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Fixtures:
+    """Api jsons (serialized) and entry pages by entry id"""
+    def __init__(self, url, size, path=None):
+        self.media = os.urandom(MEDIA_SIZE)
+        self.media_url = url + 'media/{}.jpg'
+        if path:
+            self.api = self.load_api(os.path.join(path, 'api'), size)
+            self.html = dict(list(gen_corpus(os.path.join(path, 'html')))[:size])
+        else:
+            self.api = {str(id_): json.dumps(self.gen_api_entry(id_)) for id_ in range(1, size + 1)}
+            self.html = dict(gen_synthetic_corpus(size, COMMENTS))
+            self.html = {id_: html.encode('utf-8') for id_, html in self.html.items()}
+        self.api_ids = sorted(self.api, key=int, reverse=True)
+
+    def gen_api_entry(self, id_):
+        comments = [{'id': id_ * 1000 + num, 'type': 'entry_comment', 'entry_id': id_,
+                     'author': 'user{}'.format(num), 'date': '2018-05-05 21:36:{:02d}'.format(num),
+                     'vote_count': num, 'body': JSON_BODY} for num in range(COMMENTS)]
+        return {'id': id_, 'type': 'entry', 'author': 'user{}'.format(id_),
+                'date': '2018-05-05 21:36:47', 'vote_count': id_ % 100, 'body': BODY,
+                'embed': {'url': self.media_url.format(id_), 'plus18': False},
+                'comments': comments}
+
+    def load_api(self, path, size):
+        """Recorded entries - media urls are changed to local server"""
+        api = {}
+        for file_name in sorted(os.listdir(path))[:size]:
+            id_, ext = os.path.splitext(file_name)
+            if ext == '.json' and id_.isdigit():
+                with open(os.path.join(path, file_name), encoding='utf-8') as file:
+                    entry = json.load(file)
+                for json_ in [entry] + entry.get('comments', []):
+                    if json_.get('embed'):
+                        json_['embed']['url'] = self.media_url.format(json_['id'])
+                api[id_] = json.dumps(entry)
+        return api
+
+
+class LocalAPIStrategy(APIStrategy):
+    """APIStrategy without authentication - userkey is not checked by local server"""
+    def execute(self):
+        return self.get_api_content(userkey='bench').gen_entries()
+
+
+@contextlib.contextmanager
+def local_wykop(size, fixtures_path=None):
+    """Local server and settings pointing to it, user files in temporary directory"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    server.fixtures = Fixtures(url, size, fixtures_path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        settings.USER_FILES_PATH = tmp_dir
+        settings.APPKEY = settings.SECRETKEY = 'bench'
+        settings.API_FAVORITES_URL_F = url + 'api/page/'
+        settings.API_ENTRY_URL_F = url + 'api/{{index}}'
+        settings.ENTRY_URL_SCRAPE = url + 'html/'
+        settings.EXTS = ['.jpg']
+        settings.SKIP_FILES = True
+        CreateFolders().execute()
+        DB.create()
+        try:
+            yield server.fixtures
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+def run_pipeline(strategy, method):
+    settings.ENTRIES_ADDED = settings.COMMENTS_ADDED = 0
+    taktyk.pipeline(strategy, method).join()
+    return settings.ENTRIES_ADDED + settings.COMMENTS_ADDED
+
+
+def bench_api(fixtures):
+    return timed(run_pipeline, LocalAPIStrategy, APIMethod)
+
+
+def bench_scrape(fixtures):
+    settings.SCRAPE = True
+    settings.SOURCE = {'ids': list(fixtures.html)}
+    return timed(run_pipeline, SourceStrategy, ScrapeMethod)
+
+
+def bench_html(fixtures):
+    count = run_pipeline(LocalAPIStrategy, APIMethod)
+    _, seconds = timed(HtmlFile().create)
+    return count, seconds
+
+
+def bench_download(fixtures):
+    run_pipeline(LocalAPIStrategy, APIMethod)
+    jobs = DB.get_download_jobs()
+
+    def download():
+        multi = Multi(settings.DOWNLOAD_WORKERS, save_wrapper, on_result=DB.finish_download_jobs,
+                      exts=settings.EXTS)
+        with multi as mlt:
+            for download_info in jobs:
+                mlt.put(download_info)
+        multi.join()
+        return DB.count_download_jobs().get('done', 0)
+
+    return timed(download)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def peak_rss_kb():
+    try:
+        import resource
+    except ImportError:  # windows
+        return None
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return rss // 1024 if sys.platform == 'darwin' else rss  # bytes on macOS
+
+
+def run_scenario(scenario, size, fixtures_path=None):
+    """Run in child process - result is printed as last line of stdout"""
+    logging.disable(logging.CRITICAL)
+    with local_wykop(size, fixtures_path) as fixtures:
+        with contextlib.redirect_stdout(io.StringIO()):  # progress info
+            count, seconds = globals()['bench_' + scenario](fixtures)
+    print(json.dumps({'scenario': scenario, 'size': size, 'entries': count,
+                      'seconds': round(seconds, 4),
+                      'entries_per_second': round(count / seconds, 1) if seconds else None,
+                      'peak_rss_kb': peak_rss_kb()}))
+
+
+def run_in_process(scenario, size, fixtures_path=None):
+    cmd = [sys.executable, os.path.abspath(__file__), '--run', scenario, '--sizes', str(size)]
+    if fixtures_path:
+        cmd += ['--fixtures', fixtures_path]
+    output = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def find_regressions(results, baseline_path, tolerance):
+    with open(baseline_path) as file:
+        baseline = {(r['scenario'], r['size']): r for r in json.load(file)['results']}
+    regressions = []
+    for result in results:
+        base = baseline.get((result['scenario'], result['size']))
+        if base and base['entries_per_second'] and result['entries_per_second'] is not None:
+            change = result['entries_per_second'] / base['entries_per_second'] - 1
+            if change < -tolerance:
+                regressions.append('{scenario} size {size}: '.format(**result) +
+                                   '{:.1f} -> {:.1f} entries/s ({:+.0%})'.format(
+                                       base['entries_per_second'], result['entries_per_second'],
+                                       change))
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='taktyk pipeline benchmark')
+    arg_parser.add_argument('--sizes', default='100,1000', help='numbers of entries, e.g. 100,1000')
+    arg_parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    arg_parser.add_argument('--fixtures', help='directory with api/<id>.json and html/<id>.html')
+    arg_parser.add_argument('--output', help='json file for results')
+    arg_parser.add_argument('--baseline', help='json file with results to compare with')
+    arg_parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='allowed drop of entries/s compared to baseline (0.2 = 20%%)')
+    arg_parser.add_argument('--run', choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    if args.run:
+        return run_scenario(args.run, sizes[0], args.fixtures)
+
+    results = []
+    for scenario in args.scenarios.split(','):
+        if scenario not in SCENARIOS:
+            sys.exit('Unknown scenario: {}'.format(scenario))
+        for size in sizes:
+            result = run_in_process(scenario, size, args.fixtures)
+            results.append(result)
+            print('{scenario:<10} size {size:>6}: {entries:>7} entries {seconds:8.3f} s '
+                  '{entries_per_second:>10} entries/s   peak RSS {peak_rss_kb} kB'.format(**result))
+
+    report = {'taktyk': taktyk.__version__, 'python': platform.python_version(),
+              'platform': platform.platform(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.baseline:
+        regressions = find_regressions(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
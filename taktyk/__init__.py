@@ -11,34 +11,49 @@ except ImportError:
 
 import signal
 import sys
+from functools import partial
 from . import settings
 from .args import process_args
 from .db import DB
+from .metrics import metrics
 from .render import HtmlFile
 from .save import Multi, save_wrapper
-from .utils import configure_logging, ex_hook, ConfigFile
+from .utils import configure_logging, ex_hook, gen_prefetched, ConfigFile
 
 
 def pipeline(strategy, method):
     progress_info = '\rIlość wpisów: {}      Ilość komentarzy: {}'
+    metrics_info = ''
     skip_files = settings.SKIP_FILES
     if skip_files:
-        proc_count = 0
+        workers = 0
     else:
-        proc_count = 5
+        workers = settings.DOWNLOAD_WORKERS
 
-    multi = Multi(proc_count, save_wrapper, exts=settings.EXTS)
+    writer = DB.QueueWriter()  # download results are queued after rows of their jobs
+    multi = Multi(workers, save_wrapper, on_result=partial(writer.call, DB.finish_download_jobs),
+                  queue_size=settings.DOWNLOAD_QUEUE_SIZE, exts=settings.EXTS)
 
-    with DB.Connect() as cursor, multi as mlt:
-        settings.DB_IDS = DB.get_ids(cursor, 'entry')
-        for raw_entry in strategy().execute():
-            for entry in method().generate(raw_entry):
-                DB.insert_one(cursor, entry)
-                print(progress_info.format(settings.ENTRIES_ADDED, settings.COMMENTS_ADDED), end='')
-                if entry.media_url and not skip_files:
-                    if skip_files == 'com' and entry.entry_id:
-                        continue
-                    mlt.put(entry.download_info())
+    # stages: fetch thread -> parse (here or in processes) -> writer thread -> download threads
+    with writer, multi as mlt:
+        settings.DB_IDS = set(DB.get_ids('entry') or ())
+        if settings.FULL_UPDATE:
+            settings.DB_COMMENTS_COUNTS = DB.count_comments_by_entry()
+        generator = method()
+        raw_sources = gen_prefetched(strategy().execute(), settings.FETCH_QUEUE_SIZE, 'fetch_queue')
+        for entry in generator.generate_all(raw_sources):
+            writer.add(entry)
+            generator.add_known(entry)
+            if settings.METRICS:
+                metrics_info = '      ' + (metrics.live_line() or metrics_info.lstrip())
+            print(progress_info.format(settings.ENTRIES_ADDED, settings.COMMENTS_ADDED) + metrics_info,
+                  end='')
+            if entry.media_url:  # job is recorded, so skipped files can be downloaded by --save
+                download_info = entry.download_info()
+                download = not (skip_files or settings.NSFW_FILTER and download_info['is_nsfw'])
+                writer.add_download_job(download_info, download)
+                if download:
+                    mlt.put(download_info)
 
     if settings.ENTRIES_ADDED or settings.COMMENTS_ADDED:
         print()  # for better display
@@ -55,6 +70,7 @@ def main():
     configure_logging()
     ConfigFile().set_up()
     process_args(settings.STATIC_ARGS)
-    multi = pipeline(settings.STRATEGY, settings.METHOD)
-    HtmlFile().create()
-    multi.join()
+    with DB.ReadPool():
+        multi = pipeline(settings.STRATEGY, settings.METHOD)
+        HtmlFile(incremental=True).create()
+        multi.join()
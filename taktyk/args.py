@@ -17,6 +17,16 @@ class OrderedNamespace(argparse.Namespace):
         super().__setattr__(key, value)
 
 
+def positive_int(value):
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError('{} nie jest liczbą dodatnią'.format(value))
+    return number
+
+
 def _parse(static_args=None):
     """Argument order matters. Arguments will be processed from top to bottom"""
     parser = argparse.ArgumentParser(prog='Taktyk')
@@ -43,6 +53,14 @@ def _parse(static_args=None):
     parser.add_argument('--skip', help='pomiń pobieranie plików', default=False, nargs='?',
                         const=True, choices=['com'])
     parser.add_argument('--scrape', help='włącz tryb scrapowania', action='store_true')
+    parser.add_argument('--asyncio', help='pobieraj wpisy za pomocą asyncio (wymaga modułu aiohttp). '
+                        'Opcjonalnie możesz podać limit równoczesnych zapytań.',
+                        default=False, nargs='?', const=True, type=positive_int, metavar='LIMIT')
+    parser.add_argument('--pages', help='podziel plik html na strony z podaną ilością wpisów',
+                        type=positive_int, metavar='N')
+    parser.add_argument('--metrics', help='pokaż przepustowość etapów (pobieranie, parsowanie, baza, '
+                        'pliki) i zapisz metryki w pliku .json. Opcjonalnie możesz podać ścieżkę pliku.',
+                        default=False, nargs='?', const=True, metavar='PLIK')
     parser.add_argument('--DBHandler', help=argparse.SUPPRESS, default=True)
 
     group.add_argument('-d', '--delete', help='usuwanie wpisów z wybranego zasięgu',
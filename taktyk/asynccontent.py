@@ -0,0 +1,159 @@
+import asyncio
+import itertools
+import logging
+
+try:
+    import aiohttp
+except ImportError:
+    logging.debug('ImportError - aiohttp - ' + __file__)
+
+from . import settings
+from .auth import apisign
+from .contentdelivery import ApiContent, HtmlContent
+from .metrics import metrics
+
+
+def is_available():
+    return 'aiohttp' in globals()
+
+
+def gen_results(loop, coros, limit):
+    """
+    Run coroutines taken lazily from coros iterator on loop, with at most limit in flight
+        Results are yielded as coroutines complete, empty results are skipped.
+    """
+    coros = iter(coros)
+    pending = set()
+    try:
+        while True:
+            for coro in itertools.islice(coros, limit - len(pending)):
+                pending.add(loop.create_task(coro))
+            if not pending:
+                break
+            done, pending = loop.run_until_complete(
+                asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED))
+            for task in done:
+                result = task.result()
+                if result:
+                    yield result
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+
+
+class AsyncEngine:
+    """Event loop with aiohttp.ClientSession, limit - max number of requests in flight"""
+    def __init__(self, limit=None):
+        self.limit = limit or settings.ASYNC_LIMIT
+        self.loop = None
+        self.session = None
+
+    def __enter__(self):
+        self.loop = asyncio.new_event_loop()
+        self.session = self.loop.run_until_complete(self.create_session())
+        return self
+
+    def __exit__(self, *exc):
+        self.loop.run_until_complete(self.session.close())
+        self.loop.close()
+
+    async def create_session(self):
+        connector = aiohttp.TCPConnector(limit=self.limit)
+        return aiohttp.ClientSession(connector=connector)
+
+    def gen_results(self, coros, limit=None):
+        return gen_results(self.loop, coros, limit or self.limit)
+
+    async def get_text(self, url, headers=None):
+        try:
+            async with self.session.get(url, headers=headers) as response:
+                if response.status != 200:
+                    logging.debug('%s %s', response.status, url)
+                    return None
+                return await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            logging.debug('%s %s', url, err)
+            return None
+
+    async def get_json(self, url, headers=None):
+        """Json of response, None when request failed or api returned error"""
+        try:
+            async with self.session.get(url, headers=headers) as response:
+                json_ = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+            logging.debug('%s %s', url, err)
+            return None
+        if isinstance(json_, dict) and (json_.get('error') or not json_):
+            logging.debug(json_.get('error'))
+            return None
+        return json_
+
+
+class AsyncApiContent(ApiContent):
+    """ApiContent with requests made by asyncio (aiohttp) engine"""
+    def __init__(self, appkey=None, userkey=None, secret=None, limit=None):
+        super().__init__(appkey=appkey, userkey=userkey, secret=secret)
+        self.limit = limit or settings.ASYNC_LIMIT
+
+    async def get_page(self, engine, page_num):
+        """(page_num, json), failed page is retried (settings.REQUEST_RETRIES times) with backoff"""
+        url = self.fav_url + str(page_num)
+        for attempt in range(settings.REQUEST_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(settings.REQUEST_BACKOFF * attempt)
+            with metrics.timer('page_fetch'):
+                json_ = await engine.get_json(url, headers=apisign(url, self.secret))
+            if json_ is not None:
+                return page_num, json_
+        logging.error('Nie udało się pobrać strony ulubionych: {}'.format(page_num))
+        return page_num, None
+
+    async def get_entry_json(self, engine, id_):
+        url = self.entry_url.format(index=id_)
+        with metrics.timer('entry_fetch'):
+            return await engine.get_json(url, headers=apisign(url, self.secret))
+
+    def gen_entries(self):
+        """
+        Yield favorites pages, first empty page is the end - pages past it are not requested,
+            page failed after all retries is the end too (e.g. wrong userkey, api ban)
+        """
+        last_page = None
+
+        def gen_coros(engine):
+            for page_num in itertools.count(1):
+                if last_page is not None and page_num > last_page:
+                    return
+                yield self.get_page(engine, page_num)
+
+        with AsyncEngine(self.limit) as engine:
+            limit = min(self.limit, settings.ASYNC_PAGES_LIMIT)
+            for page_num, entry_json in engine.gen_results(gen_coros(engine), limit):
+                if entry_json:
+                    yield entry_json
+                elif last_page is None or page_num < last_page:
+                    last_page = page_num
+
+    def gen_entries_by_ids(self, ids):
+        with AsyncEngine(self.limit) as engine:
+            yield from engine.gen_results(self.get_entry_json(engine, id_) for id_ in ids)
+
+
+class AsyncHtmlContent(HtmlContent):
+    """HtmlContent with requests made by asyncio (aiohttp) engine"""
+    def __init__(self, limit=None):
+        super().__init__()
+        self.limit = limit or settings.ASYNC_LIMIT
+
+    async def get_entry_html(self, engine, id_):
+        with metrics.timer('entry_fetch'):
+            html = await engine.get_text(self.entry_url + id_)
+        if html is None:
+            return []
+        return id_, html
+
+    def gen_html_entries_by_ids(self, ids):
+        with AsyncEngine(self.limit) as engine:
+            yield from engine.gen_results(self.get_entry_html(engine, id_) for id_ in ids)
@@ -171,3 +171,4 @@ class DBHandler(AbsCommand):
             self.set_db_name(self.db_list[0])
         else:
             self.choose()
+        DB.migrate()
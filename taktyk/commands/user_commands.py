@@ -1,3 +1,4 @@
+import atexit
 import logging
 import os
 import shutil
@@ -10,6 +11,7 @@ from .validators import userkey_validator, source_validator, ids_validator
 from .. import auth, settings
 from ..db import DB
 from ..entrygenerators import ScrapeMethod
+from ..metrics import metrics
 from ..render import HtmlFile
 from ..request import Request
 from ..save import Multi, Save, save_wrapper
@@ -119,16 +121,16 @@ class SaveCommand(AbsCommand):
     name = 'save'
 
     def execute(self, *args):
-        logging.info('...pobieranie plików z bazy danych')
-        db_entries = DB.get_all_entries_with_comments()
-        multi = Multi(5, save_wrapper, exts=settings.EXTS)
+        logging.info('...pobieranie niezakończonych plików z bazy danych')
+        jobs = DB.get_download_jobs(skip_comments=settings.SKIP_FILES == 'com')
+        logging.info('...ilość plików do pobrania: %s', len(jobs))
+        with DB.Connect() as cursor:
+            DB.add_download_jobs(cursor, jobs, in_progress=True)
+        multi = Multi(settings.DOWNLOAD_WORKERS, save_wrapper, on_result=DB.finish_download_jobs,
+                      queue_size=settings.DOWNLOAD_QUEUE_SIZE, exts=settings.EXTS)
         with multi as mlt:
-            for entry in db_entries:
-                if entry.media_url:
-                    mlt.put(entry.download_info())
-                for comment in entry.comments:
-                    if comment.media_url and not settings.SKIP_FILES == 'com':
-                        mlt.put(comment.download_info())
+            for download_info in jobs:
+                mlt.put(download_info)
         multi.join()
         sys.exit()
 
@@ -168,6 +170,33 @@ class ScrapeCommand(AbsCommand):
         settings.METHOD = ScrapeMethod
 
 
+class AsyncioCommand(AbsCommand):
+    name = 'asyncio'
+
+    def execute(self, arg, *args):
+        settings.ASYNC = True
+        if arg is not True:
+            settings.ASYNC_LIMIT = arg
+
+
+class PagesCommand(AbsCommand):
+    name = 'pages'
+
+    def execute(self, arg, *args):
+        settings.HTML_PAGE_SIZE = arg
+
+
+class MetricsCommand(AbsCommand):
+    name = 'metrics'
+
+    def execute(self, arg, *args):
+        settings.METRICS = True
+        if arg is not True:
+            settings.METRICS_FILE = arg
+        metrics.reset()
+        atexit.register(metrics.dump)  # also after sys.exit() of e.g. --save
+
+
 class IdsCommand(AbsCommand):
     name = 'ids'
 
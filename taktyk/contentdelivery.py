@@ -1,17 +1,75 @@
+import itertools
+import logging
+import time
+from collections import Counter, deque
 from concurrent import futures
 
 from . import settings
 from .auth import apisign
-from .request import Request
+from .metrics import metrics
+from .request import EmptyListError, Request
 
 
-def gen_entries_by_ids_with_futures(func, *args, ids=(), max_workers=0):
+def gen_entries_by_ids_with_futures(func, *args, ids=(), max_workers=0, window=None, ordered=False):
+    """
+    Call func(*args, id_) for every id in thread pool and yield true results
+        window - max number of submitted and not yet consumed calls (memory stays proportional
+                 to window, not to number of ids), default: settings.FUTURES_WINDOW
+        ordered - yield results in order of ids instead of order of completion
+    """
+    window = max(window or settings.FUTURES_WINDOW, max_workers, 1)
+    ids = iter(ids)
+    pending = deque() if ordered else set()
+    add = pending.append if ordered else pending.add
+
     with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures_lst = [executor.submit(func, *args, id_) for id_ in ids]
-        for future in futures.as_completed(futures_lst):
-            raw_entry = future.result()
-            if raw_entry:
-                yield raw_entry
+        def submit():
+            for id_ in itertools.islice(ids, window - len(pending)):
+                add(executor.submit(func, *args, id_))
+
+        try:
+            submit()
+            while pending:
+                if ordered:
+                    done = [pending.popleft()]
+                    futures.wait(done)
+                else:
+                    done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                    add = pending.add
+                submit()
+                metrics.gauge('entry_fetch_in_flight', len(pending))
+                for future in done:
+                    raw_entry = future.result()
+                    if raw_entry:
+                        yield raw_entry
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+class PagesWindow:
+    """
+    Number of favorites pages requested concurrently, adapted to responses (AIMD):
+        grows by one after each page fetched without slowing down,
+        shrinks by one when page was slow (latency > average * settings.API_PAGES_SLOW_FACTOR),
+        halves on failed request or api error (e.g. rate limit)
+    """
+    def __init__(self, size=None, max_size=None):
+        self.max_size = max(max_size or settings.API_PAGES_WINDOW, 1)
+        self.size = min(size or settings.API_PAGES_WINDOW_START, self.max_size)
+        self.latency = None
+
+    def success(self, latency):
+        if self.latency is None:
+            self.latency = latency
+        if latency > self.latency * settings.API_PAGES_SLOW_FACTOR:
+            self.size = max(self.size - 1, 1)
+        else:
+            self.size = min(self.size + 1, self.max_size)
+        self.latency = 0.8 * self.latency + 0.2 * latency
+
+    def failure(self):
+        self.size = max(self.size // 2, 1)
 
 
 class ApiContent:
@@ -32,34 +90,94 @@ class ApiContent:
             raise ValueError('Wrong url_to_prepare or id_ not set.')
 
         try:
-            json_ = Request.get_json(url, exit_=False, headers=apisign(url, self.secret))
+            with metrics.timer('entry_fetch' if id_ else 'page_fetch'):
+                json_ = Request.get_json(url, exit_=False, headers=apisign(url, self.secret))
         except ValueError:
             return []
         else:
             return json_
 
-    def submit_to_executor(self, executor):
-        if self.page_num is not None:
-            self.page_num += 1
-            return executor.submit(self.get_json, self.fav_url)
-        return False
-
-    def gen_entries(self):
-        with futures.ThreadPoolExecutor(max_workers=2) as executor:
-            futures_lst = [self.submit_to_executor(executor)]
-            while futures_lst:
-                future = self.submit_to_executor(executor)
-                if future:
-                    futures_lst.append(future)
-                entry_json = futures_lst.pop(0).result()
-                if entry_json:
-                    yield entry_json
-                else:
-                    self.page_num = None
+    def get_fav_page(self, page_num, delay=0):
+        """Favorites page json and request time, ValueError when request failed or api error"""
+        if delay:
+            time.sleep(delay)
+        url = self.fav_url + str(page_num)
+        start = time.monotonic()
+        try:
+            json_ = Request.get_json(url, exit_=False, headers=apisign(url, self.secret))
+        except EmptyListError:  # page after the last one
+            json_ = []
+        latency = time.monotonic() - start
+        metrics.add('page_fetch', seconds=latency)
+        return json_, latency
+
+    def gen_entries(self, window=None):
+        """
+        Yield favorites pages (in order of completion) fetched concurrently by PagesWindow,
+            first empty page is the end - requests for pages past it are cancelled,
+            failed pages are retried (settings.REQUEST_RETRIES times) with backoff,
+            page failed after all retries is the end too (e.g. wrong userkey, api ban)
+        """
+        window = window or PagesWindow()
+        pages = itertools.count(1)
+        retry = deque()
+        attempts = Counter()
+        pending = {}
+        last_page = None
+
+        def next_page():
+            while retry:
+                page_num = retry.popleft()
+                if last_page is None or page_num < last_page:
+                    return page_num
+            page_num = next(pages)
+            if last_page is None or page_num < last_page:
+                return page_num
+            return None
+
+        with futures.ThreadPoolExecutor(max_workers=window.max_size) as executor:
+            try:
+                while True:
+                    while len(pending) < window.size:
+                        page_num = next_page()
+                        if page_num is None:
+                            break
+                        delay = settings.REQUEST_BACKOFF * attempts[page_num]
+                        pending[executor.submit(self.get_fav_page, page_num, delay)] = page_num
+                    if not pending:
+                        break
+                    metrics.gauge('pages_in_flight', len(pending))
+                    done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                    for future in done:
+                        page_num = pending.pop(future)
+                        try:
+                            entry_json, latency = future.result()
+                        except ValueError as err:
+                            logging.debug('page {}: {}'.format(page_num, err))
+                            window.failure()
+                            attempts[page_num] += 1
+                            if attempts[page_num] <= settings.REQUEST_RETRIES:
+                                retry.append(page_num)
+                                continue
+                            logging.error('Nie udało się pobrać strony ulubionych: {}'.format(
+                                page_num))
+                        else:
+                            window.success(latency)
+                            if entry_json:
+                                yield entry_json
+                                continue
+                        if last_page is None or page_num < last_page:
+                            last_page = page_num
+                            for future_, page_num_ in list(pending.items()):
+                                if page_num_ > last_page and future_.cancel():
+                                    del pending[future_]
+            finally:
+                for future in pending:
+                    future.cancel()
 
     def gen_entries_by_ids(self, ids):
         entry_json_gen = gen_entries_by_ids_with_futures(self.get_json, self.entry_url, ids=ids,
-                                                         max_workers=5)
+                                                         max_workers=settings.ENTRY_WORKERS)
         for entry_json in entry_json_gen:
             yield entry_json
 
@@ -70,13 +188,15 @@ class HtmlContent:
 
     def get_entry(self, id_):
         entry_url = self.entry_url + id_
-        response = Request.get(entry_url, exit_=False)
+        with metrics.timer('entry_fetch'):
+            response = Request.get(entry_url, exit_=False)
         try:
             return id_, response.text
         except AttributeError:
             return []
 
     def gen_html_entries_by_ids(self, ids):
-        raw_entry_gen = gen_entries_by_ids_with_futures(self.get_entry, ids=ids, max_workers=5)
+        raw_entry_gen = gen_entries_by_ids_with_futures(self.get_entry, ids=ids,
+                                                        max_workers=settings.ENTRY_WORKERS)
         for raw_entry in raw_entry_gen:
             yield raw_entry
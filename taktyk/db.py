@@ -1,20 +1,44 @@
 import logging
 import os
+import queue
 import sqlite3
 import sys
+import threading
 import time
 import traceback
+from bisect import bisect_left
+from collections import Counter, namedtuple
 from contextlib import ContextDecorator
+from itertools import groupby
 
 from . import settings
 from .entry import Entry
+from .metrics import metrics
 from .utils import Decision
 
 
-class DB:
-    connection = None
-    cursor = None
+class ConnectionState(type):
+    """DB.connection and DB.cursor (of active DB.Connect block) are kept per thread"""
+    _local = threading.local()
 
+    @property
+    def connection(cls):
+        return getattr(cls._local, 'connection', None)
+
+    @connection.setter
+    def connection(cls, value):
+        cls._local.connection = value
+
+    @property
+    def cursor(cls):
+        return getattr(cls._local, 'cursor', None)
+
+    @cursor.setter
+    def cursor(cls, value):
+        cls._local.cursor = value
+
+
+class DB(metaclass=ConnectionState):
     @classmethod
     def create_new(cls, name):
         if name:
@@ -30,12 +54,39 @@ class DB:
         cls.create_new(name.strip())
         logging.info('...utworzono nową bazę danych: ' + settings.DB_NAME)
 
+    @staticmethod
+    def get_path():
+        return os.path.join(settings.USER_FILES_PATH, settings.DB_DIR_NAME, settings.DB_NAME)
+
+    @staticmethod
+    def open_connection(readonly=False):
+        """
+        Connection in WAL journal mode (readers and writer don't block each other), with
+        synchronous mode and page cache from settings
+            readonly - query_only connection, which may be used by any thread (one at a time)
+        """
+        connection = sqlite3.connect(DB.get_path(), timeout=settings.DB_TIMEOUT,
+                                     check_same_thread=not readonly)
+        if readonly:
+            connection.execute('PRAGMA query_only = ON')
+        elif settings.DB_WAL:
+            connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = {}'.format(settings.DB_SYNCHRONOUS))
+        connection.execute('PRAGMA cache_size = {:d}'.format(-settings.DB_CACHE_SIZE))
+        return connection
+
     class Connect(ContextDecorator):
+        """
+        Connection of this thread for the with block (DB.connection/DB.cursor), as decorator:
+            cursor is passed to function - cursor of active block or of new connection,
+            readonly - function only reads, connection from DB.ReadPool is used
+        """
+        def __init__(self, readonly=False):
+            self.readonly = readonly
+
         def __enter__(self):
-            full_db_path = os.path.join(settings.USER_FILES_PATH,
-                                        settings.DB_DIR_NAME,
-                                        settings.DB_NAME)
-            self.conn = sqlite3.connect(full_db_path)
+            self.previous = (DB.connection, DB.cursor)
+            self.conn = DB.open_connection()
             self.cursor = self.conn.cursor()
             DB.connection = self.conn
             DB.cursor = self.cursor
@@ -44,8 +95,7 @@ class DB:
         def __exit__(self, *exc):
             self.conn.commit()
             self.conn.close()
-            DB.connection = None
-            DB.cursor = None
+            DB.connection, DB.cursor = self.previous
 
         def __call__(self, func):
             def wrapper(*args, **kwargs):
@@ -55,11 +105,7 @@ class DB:
                     if arg == DB or isinstance(arg, DB):
                         index = 1
                     elif isinstance(arg, sqlite3.Cursor):
-                        if arg.connection == DB.connection:
-                            return func(*args, **kwargs)
-                        else:
-                            args.pop(index)
-                            break
+                        return func(*args, **kwargs)
                     else:
                         break
 
@@ -67,11 +113,67 @@ class DB:
                     args.insert(index, DB.cursor)
                     return func(*args, **kwargs)
                 else:
-                    with self as cur:
+                    with DB.Read() if self.readonly else DB.Connect() as cur:
                         args.insert(index, cur)
                         return func(*args, **kwargs)
             return wrapper
 
+    class Read:
+        """Read only connection for the with block - from DB.ReadPool when active, otherwise new"""
+        def __enter__(self):
+            self.conn = DB.ReadPool.acquire()
+            return self.conn.cursor()
+
+        def __exit__(self, *exc):
+            DB.ReadPool.release(self.conn)
+
+    class ReadPool:
+        """
+        While active (with block) read connections are kept open and reused by all threads,
+        at most settings.DB_READ_POOL_SIZE idle ones (e.g. for rendering and count_comments)
+        """
+        lock = threading.Lock()
+        idle = None
+        path = None
+        pid = None
+
+        def __enter__(self):
+            with DB.ReadPool.lock:
+                self.owner = DB.ReadPool.idle is None  # nested block uses outer pool
+                if self.owner:
+                    DB.ReadPool.idle = []
+                    DB.ReadPool.path = DB.get_path()
+                    DB.ReadPool.pid = os.getpid()
+            return self
+
+        def __exit__(self, *exc):
+            if self.owner:
+                with DB.ReadPool.lock:
+                    idle, DB.ReadPool.idle = DB.ReadPool.idle, None
+                for connection in idle:
+                    connection.close()
+
+        @classmethod
+        def is_active(cls):
+            """Pool is not shared with forked processes and other databases"""
+            return cls.idle is not None and cls.pid == os.getpid() and cls.path == DB.get_path()
+
+        @classmethod
+        def acquire(cls):
+            with cls.lock:
+                if cls.is_active() and cls.idle:
+                    return cls.idle.pop()
+            return DB.open_connection(readonly=True)
+
+        @classmethod
+        def release(cls, connection):
+            connection.rollback()  # ends read transaction - next read sees new data
+            with cls.lock:
+                if cls.is_active() and len(cls.idle) < settings.DB_READ_POOL_SIZE:
+                    cls.idle.append(connection)
+                    return
+            connection.close()
+
     connect = Connect
 
     @staticmethod
@@ -108,6 +210,31 @@ class DB:
                                 )''')
         except sqlite3.OperationalError:
             logging.debug(traceback.format_exc())
+        DB.migrate(cursor)
+
+    @staticmethod
+    @connect()
+    def migrate(cursor):
+        """Apply missing schema migrations, schema version is kept in PRAGMA user_version"""
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        for num, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            logging.debug('Applying database migration: %s', num)
+            cursor.execute('SAVEPOINT migration')
+            try:
+                migration(cursor)
+                cursor.execute('PRAGMA user_version = {:d}'.format(num))
+            except sqlite3.Error:
+                cursor.execute('ROLLBACK TO migration')
+                cursor.execute('RELEASE migration')
+                raise
+            cursor.execute('RELEASE migration')
+        cursor.connection.commit()
+
+    @staticmethod
+    def insert_tags(cursor, objs):
+        statement = 'INSERT OR IGNORE INTO entry_tag VALUES (?,?)'
+        params = ((obj.id_, tag) for obj in objs for tag in set(split_tags(obj.tags)))
+        cursor.executemany(statement, params)
 
     @staticmethod
     def insert_one(cursor, obj):
@@ -117,7 +244,7 @@ class DB:
             return False
 
         statement = 'INSERT INTO {} VALUES (?,?,?,?,?,?,?,?,?,?,?)'.format(obj.type_)
-        params = tuple(obj.__iter__())
+        params = obj.values()
 
         try:
             cursor.execute(statement, params)
@@ -125,13 +252,171 @@ class DB:
             logging.debug(traceback.format_exc())
             return False
         else:
+            if obj.type_ == 'entry':
+                DB.insert_tags(cursor, (obj,))
             set_added_info(obj.type_)
             return True
 
+    class Writer:
+        """
+        Buffered writer for entries and comments
+            Entries are collected per table and inserted with executemany() in batches
+            of batch_size. Every flush is done inside a savepoint and committed afterwards.
+            If a batch hits IntegrityError (duplicate) it is rolled back and inserted row by
+            row with insert_one(), so duplicates are still reported per row.
+        """
+        tables = ('entry', 'entry_comment')
+
+        def __init__(self, cursor, batch_size=None):
+            self.cursor = cursor
+            self.batch_size = batch_size or settings.DB_BATCH_SIZE
+            self.buffers = {table: [] for table in self.tables}
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self.flush()
+
+        def add(self, obj):
+            if not obj:
+                logging.debug('Entry is empty.')
+                return False
+            buffer = self.buffers[obj.type_]
+            buffer.append(obj)
+            if len(buffer) >= self.batch_size:
+                self.flush_table(obj.type_)
+            return True
+
+        def flush(self):
+            for table in self.tables:
+                self.flush_table(table)
+
+        def flush_table(self, table):
+            objs = self.buffers[table]
+            if not objs:
+                return
+            self.buffers[table] = []
+            start = time.monotonic()
+
+            statement = 'INSERT INTO {} VALUES (?,?,?,?,?,?,?,?,?,?,?)'.format(table)
+            self.cursor.execute('SAVEPOINT batch_insert')
+            try:
+                self.cursor.executemany(statement, (obj.values() for obj in objs))
+                if table == 'entry':
+                    DB.insert_tags(self.cursor, objs)
+            except sqlite3.IntegrityError:
+                logging.debug('Batch insert failed, inserting one by one: %s', table)
+                self.cursor.execute('ROLLBACK TO batch_insert')
+                self.cursor.execute('RELEASE batch_insert')
+                for obj in objs:
+                    DB.insert_one(self.cursor, obj)
+            else:
+                self.cursor.execute('RELEASE batch_insert')
+                for _ in objs:
+                    set_added_info(table)
+            self.cursor.connection.commit()
+            metrics.add('db_insert', len(objs), time.monotonic() - start)
+
+    class QueueWriter(Writer):
+        """
+        Writer with own connection in separate thread - add() and call() only put into queue
+        (at most settings.DB_WRITE_QUEUE_SIZE waiting), so producer doesn't wait for inserts
+            Batch is flushed when full and after settings.DB_FLUSH_INTERVAL seconds without
+            new items (also committing calls). Error in writer thread is raised by next add()/exit.
+        """
+        def __init__(self, batch_size=None, maxsize=None):
+            super().__init__(None, batch_size)
+            self.queue = queue.Queue(maxsize or settings.DB_WRITE_QUEUE_SIZE)
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.error = None
+            self.download_jobs = []
+
+        def __enter__(self):
+            self.thread.start()
+            return self
+
+        def __exit__(self, *exc):
+            if self.thread.is_alive():
+                self.queue.put(None)
+                self.thread.join()
+            self.raise_error()
+
+        def raise_error(self):
+            if self.error:
+                error, self.error = self.error, None
+                raise error
+
+        def add(self, obj):
+            if not obj:
+                logging.debug('Entry is empty.')
+                return False
+            self.raise_error()
+            self.queue.put(obj)
+            return True
+
+        def add_download_job(self, download_info, in_progress=False):
+            """Download job recorded (DB.add_download_jobs) in batch, before calls queued later"""
+            self.raise_error()
+            self.queue.put(DownloadJob(download_info, in_progress))
+
+        def flush(self):
+            DB.Writer.flush(self)
+            self.flush_download_jobs()
+
+        def flush_download_jobs(self):
+            jobs, self.download_jobs = self.download_jobs, []
+            for in_progress in (False, True):
+                infos = [job.info for job in jobs if job.in_progress == in_progress]
+                if infos:
+                    DB.add_download_jobs(self.cursor, infos, in_progress)
+
+        def call(self, func, *args):
+            """
+            func(cursor, *args) in writer thread, after objects added before are inserted,
+            func(*args) when writer thread is not running (func decorated with connect())
+            """
+            if self.thread.is_alive():
+                self.raise_error()
+                self.queue.put((func, args))
+            else:
+                func(*args)
+
+        def _run(self):
+            item = True
+            try:
+                with DB.Connect() as cursor:
+                    self.cursor = cursor
+                    while True:
+                        try:
+                            item = self.queue.get(timeout=settings.DB_FLUSH_INTERVAL)
+                        except queue.Empty:
+                            self.flush()
+                            cursor.connection.commit()
+                            continue
+                        if item is None:
+                            break
+                        if isinstance(item, DownloadJob):
+                            self.download_jobs.append(item)
+                            if len(self.download_jobs) >= self.batch_size:
+                                self.flush_download_jobs()
+                        elif isinstance(item, tuple):
+                            self.flush_download_jobs()  # e.g. results of these jobs
+                            func, args = item
+                            func(cursor, *args)
+                        else:
+                            DB.Writer.add(self, item)
+                    self.flush()
+            except Exception as err:
+                logging.debug(traceback.format_exc())
+                self.error = err
+                while item is not None:  # producer must not block on full queue
+                    item = self.queue.get()
+
     @classmethod
-    @connect()
+    @connect(readonly=True)
     def get_ids(cls, cursor, table: '"entry" or "entry_comment"', tag=None):
-        condition, params = cls.get_condition_and_params(tag)
+        condition, params = cls.get_condition_and_params(tag, table)
         statement = 'SELECT id FROM {} {} ORDER BY date DESC'.format(table, condition)
         try:
             return [row[0] for row in cursor.execute(statement, params).fetchall()]
@@ -139,7 +424,7 @@ class DB:
             logging.debug('Fetching ids failed')
 
     @staticmethod
-    @connect()
+    @connect(readonly=True)
     def get_entry_row(cursor, id_):
         statement = 'SELECT * FROM entry WHERE id = (?)'
         params = (id_,)
@@ -151,7 +436,7 @@ class DB:
             return row
 
     @staticmethod
-    @connect()
+    @connect(readonly=True)
     def get_comments_by_entry_id(cursor, id_):
         statement = 'SELECT * FROM entry_comment WHERE entry_id = (?)'
         params = (id_,)
@@ -163,7 +448,7 @@ class DB:
             logging.debug(traceback.format_exc())
 
     @classmethod
-    @connect()
+    @connect(readonly=True)
     def get_entry_with_comments(cls, cursor, id_):
         row = cls.get_entry_row(cursor, id_)
         try:
@@ -175,31 +460,55 @@ class DB:
             return entry
 
     @classmethod
-    @connect()
-    def get_all_entries_with_comments(cls, cursor, tag=None):
-        return (cls.get_entry_with_comments(id_) for id_ in cls.get_ids(cursor, 'entry', tag=tag))
+    def get_all_entries_with_comments(cls, cursor=None, tag=None, page=None):
+        """
+        Generate entries with comments and comments count attached, using a single query
+            page - (export, page number) - only entries assigned to page of paginated export
+        """
+        cursor = cursor or DB.cursor
+        if cursor:
+            yield from cls._gen_entries_with_comments(cursor, tag, page)
+        else:
+            with DB.Read() as cursor:
+                yield from cls._gen_entries_with_comments(cursor, tag, page)
 
     @classmethod
-    @connect()
+    def _gen_entries_with_comments(cls, cursor, tag=None, page=None):
+        condition, params = cls.get_condition_and_params(tag)
+        if page:
+            params['export'], params['page'] = page
+            page_condition = 'id IN (SELECT entry_id FROM render_state ' \
+                             'WHERE export = :export AND page = :page)'
+            condition = '{} {} {}'.format(condition, 'AND' if condition else 'WHERE',
+                                          page_condition)
+        statement = 'SELECT e.*, c.* FROM (SELECT * FROM entry {}) AS e ' \
+                    'LEFT JOIN entry_comment AS c ON c.entry_id = e.id ' \
+                    'ORDER BY e.date DESC, e.id, c.id'.format(condition)
+        rows = cursor.connection.cursor().execute(statement, params)  # own cursor, used lazily
+        for _, entry_rows in groupby(rows, key=lambda row: row[0]):
+            entry = None
+            comments = []
+            for row in entry_rows:
+                if entry is None:
+                    entry = Entry(*row[:11], type_='entry')
+                if row[11] is not None:
+                    comments.append(Entry(*row[11:], type_='entry_comment'))
+            entry.comments = comments
+            entry.comments_count = len(comments)
+            yield entry
+
+    @classmethod
+    @connect(readonly=True)
     def count_tags(cls, cursor, arg_tag=None):
-        tags_dict = {}
         condition, params = cls.get_condition_and_params(arg_tag)
-        statement = 'SELECT tags FROM entry {}'.format(condition)
+        if condition:
+            condition = 'WHERE entry_id IN (SELECT id FROM entry {})'.format(condition)
+        statement = 'SELECT tag, COUNT(*) AS count FROM entry_tag {} ' \
+                    'GROUP BY tag ORDER BY count DESC, tag'.format(condition)
         try:
-            tags = cursor.execute(statement, params).fetchall()
+            return cursor.execute(statement, params).fetchall()
         except sqlite3.IntegrityError:
             logging.debug('Fetching tags failed')
-            return
-
-        for tags_row in tags:
-            tags = set(tags_row[0].strip().split(' '))
-            for tag in tags:
-                if tag in tags_dict.keys():
-                    tags_dict[tag] += 1
-                else:
-                    tags_dict[tag] = 1
-
-        return sorted(tags_dict.items(), key=lambda x: x[1], reverse=True)
 
     @staticmethod
     @connect()
@@ -207,32 +516,201 @@ class DB:
         try:
             cursor.execute('PRAGMA foreign_keys=ON')
             cursor.execute('DELETE FROM entry WHERE id=(?)', (entry_id,))
+            cursor.execute('DELETE FROM download_job WHERE id = ? OR id GLOB ?',
+                           (str(entry_id), '{}_*'.format(entry_id)))  # entry and its comments
         except sqlite3.IntegrityError:
             logging.debug('Deletion failed: %s', entry_id)
             return False
 
     @staticmethod
-    @connect()
+    @connect(readonly=True)
     def count_comments(cursor, entry_id):
-        statement = 'SELECT id FROM entry_comment WHERE entry_id=(?)'
+        statement = 'SELECT COUNT(*) FROM entry_comment WHERE entry_id=(?)'
         params = (entry_id,)
         try:
-            comments_ids = cursor.execute(statement, params).fetchall()
+            return cursor.execute(statement, params).fetchone()[0]
         except sqlite3.IntegrityError:
             logging.debug(traceback.format_exc())
-        else:
-            return len(comments_ids)
 
     @staticmethod
-    def get_condition_and_params(tag):
+    @connect(readonly=True)
+    def count_comments_by_entry(cursor):
+        """{entry_id: comments count} of entries with comments - single query for full update"""
+        statement = 'SELECT entry_id, COUNT(*) FROM entry_comment GROUP BY entry_id'
+        return dict(cursor.execute(statement).fetchall())
+
+    @classmethod
+    @connect()
+    def update_render_state(cls, cursor, export, page_size, tag=None, reset=False):
+        """
+        Assign entries to pages of paginated export, return (pages to render, pages count)
+            Once assigned, entry stays on its page (pages ordered from the oldest). New entry
+            newer than all entries fills up the last page, older one (e.g. old entry added to
+            favorites) goes to the page of its date, so date ranges of pages don't overlap -
+            when such page grows over 2 * page_size, all entries are assigned again.
+            Pages after a page left without entries are moved back by one.
+            Page has to be rendered again if entry was added to it or removed from it,
+            or if comments count of its entry has changed.
+        """
+        nsfw_filter = int(bool(settings.NSFW_FILTER))
+        statement = 'SELECT page_size, nsfw_filter FROM render_export WHERE export = ?'
+        if reset or cursor.execute(statement, (export,)).fetchone() != (page_size, nsfw_filter):
+            cursor.execute('DELETE FROM render_state WHERE export = ?', (export,))
+            cursor.execute('INSERT OR REPLACE INTO render_export VALUES (?,?,?)',
+                           (export, page_size, nsfw_filter))
+
+        condition, params = cls.get_condition_and_params(tag)
+        statement = 'SELECT id, date, (SELECT COUNT(*) FROM entry_comment WHERE entry_id = e.id) ' \
+                    'FROM entry AS e {}'.format(condition)
+        current = {id_: (date, comments) for id_, date, comments
+                   in cursor.execute(statement, params).fetchall()}
+        statement = 'SELECT entry_id, page, comments FROM render_state WHERE export = ?'
+        state = {id_: (page, comments) for id_, page, comments
+                 in cursor.execute(statement, (export,)).fetchall()}
+
+        old_pages_count = max((page for page, _ in state.values()), default=0)
+        to_render = set()
+        removed, changed = [], []
+        for id_, (page, comments) in state.items():
+            if id_ not in current:
+                removed.append((export, id_))
+                to_render.add(page)
+            elif current[id_][1] != comments:
+                changed.append((current[id_][1], export, id_))
+                to_render.add(page)
+
+        page_counts = Counter(page for id_, (page, _) in state.items() if id_ in current)
+        newest = {}  # page: (date, id) of its newest entry
+        for id_, (page, _) in state.items():
+            if id_ in current:
+                newest[page] = max(newest.get(page, ()), (current[id_][0], id_))
+        bound_pages = sorted(newest)
+        bounds = []
+        for page in bound_pages:
+            bounds.append(max(bounds[-1], newest[page]) if bounds else newest[page])
+
+        page = max(page_counts, default=1)
+        new = []
+        for id_ in sorted((id_ for id_ in current if id_ not in state),
+                          key=lambda x: (current[x][0], x)):
+            index = bisect_left(bounds, (current[id_][0], id_))
+            if index < len(bounds):  # older than newest entry of that page
+                new_page = bound_pages[index]
+            else:
+                while page_counts[page] >= page_size:
+                    page += 1
+                new_page = page
+            page_counts[new_page] += 1
+            new.append((export, id_, new_page, current[id_][1]))
+            to_render.add(new_page)
+
+        if any(count > 2 * page_size for count in page_counts.values()):
+            return cls.update_render_state(cursor, export, page_size, tag, reset=True)
+
+        # pages after page left without entries are moved back, so page numbers (and links
+        # to newer/older page) stay contiguous - these pages are rendered again
+        empty = [page for page in range(1, max(page_counts, default=0)) if not page_counts[page]]
+        moved = {page: page - bisect_left(empty, page) for page in page_counts
+                 if empty and page > empty[0]}
+        if moved:
+            new = [(export_, id_, moved.get(page, page), comments)
+                   for export_, id_, page, comments in new]
+            page_counts = Counter({moved.get(page, page): count
+                                   for page, count in page_counts.items()})
+            to_render.update(range(empty[0], max(page_counts) + 1))
+
+        cursor.executemany('DELETE FROM render_state WHERE export = ? AND entry_id = ?', removed)
+        cursor.executemany('UPDATE render_state SET comments = ? WHERE export = ? AND entry_id = ?',
+                           changed)
+        cursor.executemany('UPDATE render_state SET page = ? WHERE export = ? AND page = ?',
+                           ((moved[page], export, page) for page in sorted(moved)))
+        cursor.executemany('INSERT INTO render_state VALUES (?,?,?,?)', new)
+
+        pages_count = max(page_counts, default=0)
+        if old_pages_count != pages_count:  # links to newer/older page changed
+            to_render.add(min(old_pages_count, pages_count))
+        return {page for page in to_render if 0 < page <= pages_count}, pages_count
+
+    @staticmethod
+    @connect(readonly=True)
+    def get_render_pages(cursor, export):
+        """[(page, entries count, newest date, oldest date), ...] - starting from the newest page"""
+        statement = 'SELECT r.page, COUNT(*), MAX(e.date), MIN(e.date) FROM render_state AS r ' \
+                    'JOIN entry AS e ON e.id = r.entry_id WHERE r.export = ? ' \
+                    'GROUP BY r.page ORDER BY r.page DESC'
+        return cursor.execute(statement, (export,)).fetchall()
+
+    @staticmethod
+    @connect()
+    def reset_render_state(cursor, export):
+        cursor.execute('DELETE FROM render_export WHERE export = ?', (export,))
+        cursor.execute('DELETE FROM render_state WHERE export = ?', (export,))
+
+    @staticmethod
+    def add_download_jobs(cursor, download_infos, in_progress=False):
+        """
+        Record download jobs (Entry.download_info() dicts) as pending, or as in progress
+        when they are handed to download workers right away
+        """
+        download_infos = list(download_infos)
+        statement = 'INSERT OR IGNORE INTO download_job VALUES (?,?,?,?,?,?,0)'
+        cursor.executemany(statement, ((info['id_'], info['media_url'], info['is_nsfw'],
+                                        info['local_file_path'], '_' in info['id_'], JOB_PENDING)
+                                       for info in download_infos))
+        if in_progress:
+            cursor.executemany('UPDATE download_job SET status = ? WHERE id = ?',
+                               ((JOB_IN_PROGRESS, info['id_']) for info in download_infos))
+
+    @staticmethod
+    @connect(readonly=True)
+    def get_download_jobs(cursor, skip_comments=False):
+        """
+        Download info dicts of unfinished jobs (not done/skipped and below max attempts),
+        nsfw jobs are left pending when settings.NSFW_FILTER is on
+        """
+        statement = 'SELECT id, media_url, is_nsfw, local_file_path FROM download_job ' \
+                    'WHERE status NOT IN (?, ?) AND attempts < ?'
+        if skip_comments:
+            statement += ' AND NOT comment'
+        if settings.NSFW_FILTER:
+            statement += ' AND NOT is_nsfw'
+        params = (JOB_DONE, JOB_SKIPPED, settings.DOWNLOAD_MAX_ATTEMPTS)
+        return [{'id_': id_, 'media_url': media_url, 'is_nsfw': bool(is_nsfw),
+                 'local_file_path': local_file_path} for id_, media_url, is_nsfw, local_file_path
+                in cursor.execute(statement, params).fetchall()]
+
+    @staticmethod
+    @connect()
+    def finish_download_jobs(cursor, results):
+        """
+        results - [(download_info, download result), ...] reported by download workers,
+            result None - file not saved on purpose (unsupported file), not retried
+        """
+        statement = 'UPDATE download_job SET status = ?, attempts = attempts + 1 WHERE id = ?'
+        cursor.executemany(statement, ((job_status(result), info['id_']) for info, result in results))
+        cursor.connection.commit()
+
+    @staticmethod
+    @connect(readonly=True)
+    def count_download_jobs(cursor):
+        """{status: jobs count}"""
+        statement = 'SELECT status, COUNT(*) FROM download_job GROUP BY status'
+        return dict(cursor.execute(statement).fetchall())
+
+    @staticmethod
+    def get_condition_and_params(tag, table='entry'):
         condition = ''
         params = {}
         if settings.NSFW_FILTER:
             params['nsfw'] = 0
             condition = 'WHERE is_nsfw = :nsfw'
         if tag:
-            params['tag'] = '% {} %'.format(tag)
-            tag_condition = 'tags LIKE :tag'
+            if table == 'entry':
+                params['tag'] = tag
+                tag_condition = 'id IN (SELECT entry_id FROM entry_tag WHERE tag = :tag)'
+            else:
+                params['tag'] = '% {} %'.format(tag)
+                tag_condition = 'tags LIKE :tag'
             if condition:
                 condition += ' AND {}'.format(tag_condition)
             else:
@@ -240,6 +718,84 @@ class DB:
         return condition, params
 
 
+# download_job status
+JOB_PENDING = 'pending'
+JOB_IN_PROGRESS = 'in_progress'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_SKIPPED = 'skipped'
+
+DownloadJob = namedtuple('DownloadJob', 'info in_progress')
+
+
+def job_status(result):
+    if result is None:
+        return JOB_SKIPPED
+    return JOB_DONE if result else JOB_FAILED
+
+
+def split_tags(tags):
+    """' tag1 tag2 ' -> ['tag1', 'tag2'] (entries without tags are stored as ' # ')"""
+    return tags.split() if tags else []
+
+
+def _migration_indexes_and_tags(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS entry_date_idx ON entry (date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS entry_comment_entry_id_idx '
+                   'ON entry_comment (entry_id)')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS entry_tag (
+                        entry_id INTEGER(20) NOT NULL,
+                        tag VARCHAR(80) NOT NULL,
+                        PRIMARY KEY (entry_id, tag),
+                        FOREIGN KEY (entry_id) REFERENCES entry (id) ON DELETE CASCADE
+                        )''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS entry_tag_tag_idx ON entry_tag (tag)')
+    rows = cursor.execute('SELECT id, tags FROM entry').fetchall()
+    cursor.executemany('INSERT OR IGNORE INTO entry_tag VALUES (?,?)',
+                       ((id_, tag) for id_, tags in rows for tag in set(split_tags(tags))))
+
+
+def _migration_render_state(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS render_export (
+                        export VARCHAR(255) NOT NULL PRIMARY KEY,
+                        page_size INTEGER NOT NULL,
+                        nsfw_filter BOOLEAN NOT NULL
+                        )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS render_state (
+                        export VARCHAR(255) NOT NULL,
+                        entry_id INTEGER(20) NOT NULL,
+                        page INTEGER NOT NULL,
+                        comments INTEGER NOT NULL,
+                        PRIMARY KEY (export, entry_id)
+                        )''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS render_state_page_idx ON render_state (export, page)')
+
+
+def _migration_download_jobs(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS download_job (
+                        id VARCHAR(41) NOT NULL PRIMARY KEY,
+                        media_url VARCHAR(255) NOT NULL,
+                        is_nsfw BOOLEAN NOT NULL,
+                        local_file_path VARCHAR(255) NOT NULL,
+                        comment BOOLEAN NOT NULL,
+                        status VARCHAR(11) NOT NULL,
+                        attempts INTEGER NOT NULL DEFAULT 0
+                        )''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS download_job_status_idx ON download_job (status)')
+    for table in ('entry', 'entry_comment'):  # media of entries saved before jobs were recorded
+        statement = "SELECT * FROM {} WHERE media_url IS NOT NULL AND media_url != ''".format(table)
+        rows = cursor.execute(statement).fetchall()
+        DB.add_download_jobs(cursor, (Entry(*row).download_info() for row in rows))
+
+
+# list index + 1 = schema version (PRAGMA user_version) after applying migration
+MIGRATIONS = [
+    _migration_indexes_and_tags,
+    _migration_render_state,
+    _migration_download_jobs,
+]
+
+
 def database_list(path):
     return [file for file in os.listdir(path) if file.endswith('.db')]
 
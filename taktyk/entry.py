@@ -1,11 +1,16 @@
 import os
-from inspect import signature
+from operator import attrgetter
 
 from . import db
 from . import settings
 
 
 class Entry:
+    COLUMNS = ('id_', 'author', 'date', 'body', 'body_html', 'url', 'plus', 'media_url', 'tags',
+               'is_nsfw', 'entry_id')  # order of columns in database tables
+    __slots__ = COLUMNS + ('type_', 'comments', '_comments_count', '_media_key', '_media_ext',
+                           '_local_file_path')
+
     def __init__(self, id_=None, author=None, date=None, body=None, body_html=None, url=None,
                  plus=None, media_url=None, tags=None, is_nsfw=None, entry_id=None, type_=None):
         self.id_ = id_
@@ -20,13 +25,19 @@ class Entry:
         self.is_nsfw = is_nsfw
         self.entry_id = entry_id  # only for comment
         self.type_ = type_
+        self.comments = ()
+        self._comments_count = None
+        self._media_key = None
+
+    def values(self):
+        """Tuple of column values - row for database"""
+        return _get_columns(self)
 
     def __iter__(self):
         return self.attrs_gen()
 
     def attrs_gen(self):
-        attrs = list(signature(self.__init__).parameters.keys())  # attributes from __init__()
-        return (getattr(self, attr) for attr in attrs[:11])
+        return iter(self.values())
 
     def __str__(self):
         if self.entry_id:
@@ -44,10 +55,32 @@ class Entry:
     @property
     def comments_count(self):
         if not self.entry_id:  # if entry_id is not none it's a comment
-            return db.DB.count_comments(self.id_)
+            if self._comments_count is None:
+                return db.DB.count_comments(self.id_)
+            return self._comments_count
+
+    @comments_count.setter
+    def comments_count(self, value):
+        self._comments_count = value
+
+    def _get_media_cache(self):
+        """(media_ext, local_file_path) computed once, recomputed only if fields they use changed"""
+        key = (self.media_url, self.is_nsfw, self.entry_id, self.id_)
+        if key != self._media_key:
+            self._media_ext = self._compute_media_ext()
+            self._local_file_path = self._compute_local_file_path(self._media_ext)
+            self._media_key = key
+        return self._media_ext, self._local_file_path
 
     @property
     def media_ext(self):
+        return self._get_media_cache()[0]
+
+    @property
+    def local_file_path(self):
+        return self._get_media_cache()[1]
+
+    def _compute_media_ext(self):
         if self.media_url:
             _, ext = os.path.splitext(self.media_url)
             if len(ext) > 4 and '?' in ext:  # fix for urls with '?'
@@ -58,10 +91,8 @@ class Entry:
         else:
             return None
 
-    @property
-    def local_file_path(self):
+    def _compute_local_file_path(self, ext):
         path = settings.FILES_DIR_NAME
-        ext = self.media_ext
 
         if self.media_url and ext:
             if self.is_nsfw:
@@ -71,3 +102,6 @@ class Entry:
                                     '{}_{}{}'.format(self.entry_id, self.id_, ext))
             return os.path.join(path, '{}{}'.format(self.id_, ext))
         return ''
+
+
+_get_columns = attrgetter(*Entry.COLUMNS)
@@ -1,7 +1,12 @@
 import abc
+import multiprocessing
+import os
+import time
+from collections import deque
 
 from . import settings
 from .db import DB
+from .metrics import call_with_metrics, metrics
 from .parsers import JsonParser, HtmlParser
 
 
@@ -11,13 +16,36 @@ class GenerateStrategy(metaclass=abc.ABCMeta):
         self.db_handler = db_handler or DB
         self.full_update = settings.FULL_UPDATE
         self.db_ids = settings.DB_IDS
+        self.comments_counts = settings.DB_COMMENTS_COUNTS
         self.nsfw_filter = settings.NSFW_FILTER
 
+    def add_known(self, entry):
+        """
+        Entry handed over for insert - db_ids (set) and comments_counts are kept up to date,
+        so entry repeated later in the same run is treated as already in database
+        """
+        if not entry.entry_id:
+            self.db_ids.add(int(entry.id_))
+        elif self.comments_counts is not None:
+            entry_id = int(entry.entry_id)
+            self.comments_counts[entry_id] = self.comments_counts.get(entry_id, 0) + 1
+
+    def count_comments(self, id_):
+        """Comments of entry in database - from preloaded comments_counts, otherwise by query"""
+        if self.comments_counts is None:
+            return self.db_handler.count_comments(id_)
+        return self.comments_counts.get(int(id_), 0)
+
     @abc.abstractmethod
     def generate(self, raw_source):
         """Method will generate entry/entries from raw_source using parser passed in __init__"""
         pass
 
+    def generate_all(self, raw_sources):
+        """Generate entries from every raw_source in raw_sources"""
+        for raw_source in raw_sources:
+            yield from self.generate(raw_source)
+
 
 class APIMethod(GenerateStrategy):
     """Strategy for generating Entry objects using WykopAPI"""
@@ -35,17 +63,17 @@ class APIMethod(GenerateStrategy):
         entry = parser.entry
 
         if not entry.id_:
-            raise StopIteration('Entry is empty')
+            return
 
         if entry.id_ not in self.db_ids:
             parser.parse()
             if self.nsfw_filter and entry.is_nsfw:
-                raise StopIteration('Unwanted nsfw content.')
+                return
             yield entry
         elif self.full_update:
-            db_comment_count = db_comment_count or self.db_handler.count_comments(entry.id_)
+            db_comment_count = db_comment_count or self.count_comments(entry.id_)
         else:
-            raise StopIteration('Entry already in database.')
+            return
 
         comments = json_.get('comments')
         comments = comments[db_comment_count:]  # slicing list for new comments only
@@ -59,6 +87,26 @@ class APIMethod(GenerateStrategy):
                 yield entry
 
 
+def parse_html_entry(parser_cls, id_, raw_entry, start_index, nsfw_filter):
+    """
+    List of Entry objects parsed from raw_entry html, starting from soup with start_index
+    (0 = main entry) - picklable, used by ScrapeMethod in process pool
+    """
+    start = time.monotonic()
+    parser = parser_cls(id_, raw_entry)
+    entries = []
+    if start_index == 0:
+        main_entry = parser.get_main_entry()
+        if main_entry and not (nsfw_filter and main_entry.is_nsfw):
+            entries.append(main_entry)
+        start_index = 1 if entries else None
+    if start_index:
+        entries.extend(comment for comment in parser.get_comments_generator(start_index)
+                       if comment)
+    metrics.add('parse', len(entries), time.monotonic() - start)
+    return entries
+
+
 class ScrapeMethod(GenerateStrategy):
     """Strategy for generating Entry objects using BeautifulSop"""
     def __init__(self, parser_cls=None, db_handler=None):
@@ -75,13 +123,56 @@ class ScrapeMethod(GenerateStrategy):
         if int(id_) not in self.db_ids:
             main_entry = parser.get_main_entry()
             if (not main_entry) or (self.nsfw_filter and main_entry.is_nsfw):
-                raise StopIteration('Entry is empty or unwanted nsfw content.')
+                return
             yield main_entry
         elif self.full_update:
-            comments_start_index += self.db_handler.count_comments(id_)  # index for new comments
+            comments_start_index += self.count_comments(id_)  # index for new comments
         else:
-            raise StopIteration('Entry already in database.')
+            return
 
         for comment in parser.get_comments_generator(comments_start_index):
             if comment:
                 yield comment
+
+    def get_start_index(self, id_):
+        """Index of first soup to parse (0 = main entry), None if entry is already in database"""
+        if int(id_) not in self.db_ids:
+            return 0
+        elif self.full_update:
+            return 1 + self.count_comments(id_)
+        return None
+
+    @staticmethod
+    def _get_parsed(result):
+        entries, worker_metrics = result.get()
+        metrics.merge(worker_metrics)
+        return entries
+
+    def generate_all(self, raw_sources):
+        """
+        raw_sources - (id_, html) iterable, html is parsed in process pool (settings.PARSE_PROCESSES)
+            and only database reads stay in this process, entries are yielded in order of raw_sources
+        """
+        processes = settings.PARSE_PROCESSES or os.cpu_count() or 1
+        if processes == 1:
+            for id_, raw_entry in raw_sources:
+                start_index = self.get_start_index(id_)
+                if start_index is not None:
+                    yield from parse_html_entry(self.parser_cls, id_, raw_entry, start_index,
+                                                self.nsfw_filter)
+            return
+
+        # spawned (not forked) workers - fetch, writer and download threads are already running
+        with multiprocessing.get_context('spawn').Pool(processes) as pool:  # terminated on exit
+            pending = deque()
+            for id_, raw_entry in raw_sources:
+                start_index = self.get_start_index(id_)
+                if start_index is None:
+                    continue
+                pending.append(pool.apply_async(call_with_metrics, (
+                    parse_html_entry, self.parser_cls, id_, raw_entry, start_index,
+                    self.nsfw_filter)))
+                if len(pending) >= processes * 2:
+                    yield from self._get_parsed(pending.popleft())
+            while pending:
+                yield from self._get_parsed(pending.popleft())
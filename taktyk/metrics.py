@@ -0,0 +1,112 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from . import settings
+
+
+class Metrics:
+    """
+    Counters and timings of pipeline stages (page fetch, entry fetch, parse, db insert,
+    download...) and depths of queues, shared by threads of the process
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.stages = {}
+        self.gauges = {}
+        self.last_line = 0
+
+    def reset(self):
+        with self.lock:
+            self.start = time.time()
+            self.stages = {}
+            self.gauges = {}
+
+    def add(self, stage, count=1, seconds=0.0, bytes_=0):
+        with self.lock:
+            data = self.stages.setdefault(stage, {'count': 0, 'seconds': 0.0, 'bytes': 0})
+            data['count'] += count
+            data['seconds'] += seconds
+            data['bytes'] += bytes_
+
+    @contextmanager
+    def timer(self, stage, count=1):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(stage, count, time.monotonic() - start)
+
+    def gauge(self, name, value):
+        """Current and max value of e.g. queue depth"""
+        with self.lock:
+            data = self.gauges.setdefault(name, {'current': 0, 'max': 0})
+            data['current'] = value
+            data['max'] = max(data['max'], value)
+
+    def snapshot(self):
+        with self.lock:
+            return {'stages': {stage: dict(data) for stage, data in self.stages.items()},
+                    'gauges': {name: dict(data) for name, data in self.gauges.items()}}
+
+    def merge(self, snapshot):
+        """Add snapshot of metrics collected in other (worker) process"""
+        for stage, data in snapshot['stages'].items():
+            self.add(stage, data['count'], data['seconds'], data['bytes'])
+        for name, data in snapshot['gauges'].items():
+            self.gauge(name, data['current'])
+            with self.lock:
+                self.gauges[name]['max'] = max(self.gauges[name]['max'], data['max'])
+
+    def report(self):
+        """Snapshot with rates - per second of run (wall time) and average time of one item"""
+        elapsed = max(time.time() - self.start, 1e-9)
+        report = self.snapshot()
+        for data in report['stages'].values():
+            data['per_second'] = round(data['count'] / elapsed, 3)
+            data['avg_ms'] = round(data['seconds'] * 1000 / data['count'], 3) if data['count'] else 0
+            data['bytes_per_second'] = round(data['bytes'] / elapsed, 1)
+        report['elapsed'] = round(elapsed, 3)
+        return report
+
+    def format_line(self):
+        report = self.report()
+        parts = []
+        for stage, data in sorted(report['stages'].items()):
+            part = '{} {:.1f}/s'.format(stage, data['per_second'])
+            if data['bytes']:
+                part += ' {:.2f} MB/s'.format(data['bytes_per_second'] / 1048576)
+            parts.append(part)
+        parts.extend('{} {}'.format(name, data['current'])
+                     for name, data in sorted(report['gauges'].items()))
+        return ' | '.join(parts)
+
+    def live_line(self, interval=1.0):
+        """format_line() at most once per interval seconds, otherwise None"""
+        now = time.monotonic()
+        if now - self.last_line < interval:
+            return None
+        self.last_line = now
+        return self.format_line()
+
+    def dump(self, path=None):
+        path = path or settings.METRICS_FILE
+        report = self.report()
+        with open(path, 'w') as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+        for stage, data in sorted(report['stages'].items()):
+            logging.debug('%s: %s', stage, data)
+        logging.info('...metryki zapisane w pliku: %s', path)
+
+
+metrics = Metrics()
+
+
+def call_with_metrics(func, *args):
+    """Call func in worker process and return (result, metrics collected during call)"""
+    metrics.reset()
+    result = func(*args)
+    return result, metrics.snapshot()
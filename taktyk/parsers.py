@@ -1,4 +1,6 @@
+import html.parser
 import logging
+import re
 
 try:
     import bs4
@@ -7,6 +9,79 @@ except ImportError:
 
 from . import settings
 from .entry import Entry
+from .metrics import metrics
+
+
+def get_bs4_features():
+    """bs4 tree builder for pages: settings.HTML_PARSER, html.parser if not set"""
+    return settings.HTML_PARSER or 'html.parser'
+
+
+class BodyTokenizer(html.parser.HTMLParser):
+    """
+    Hrefs of anchors and text of entry body collected straight from html.parser tokenizer,
+    same output as BeautifulSoup with html.parser builder, but without building a tree
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.hrefs = []
+        self.text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            self.hrefs.append(dict(attrs).get('href'))
+
+    def handle_data(self, data):
+        self.text.append(data)
+
+    def handle_comment(self, data):
+        self.text.append(data)
+
+    def unknown_decl(self, data):
+        if data.startswith('CDATA['):
+            self.text.append(data[6:])
+
+
+def parse_body_tokenizer(body_html):
+    tokenizer = BodyTokenizer()
+    tokenizer.feed('<html>{}</html>'.format(body_html))
+    tokenizer.close()
+    return tokenizer.hrefs, ''.join(tokenizer.text)
+
+
+def parse_body_bs4(body_html):
+    body = bs4.BeautifulSoup('<html>{}</html>'.format(body_html), 'html.parser')
+    return [a.get('href') for a in body.find_all('a')], ''.join(body.find_all(text=True))
+
+
+BODY_PARSERS = {
+    'tokenizer': parse_body_tokenizer,
+    'bs4': parse_body_bs4,
+}
+
+
+def parse_body(body_html):
+    """(hrefs, text) of entry body_html parsed by settings.BODY_PARSER backend"""
+    return BODY_PARSERS.get(settings.BODY_PARSER, parse_body_tokenizer)(body_html)
+
+
+HREF_REGEX = re.compile(r'''(href=)(["'])([#@])(.*?)\2''')
+HREF_URLS = {
+    '#': 'https://www.wykop.pl/tag/',
+    '@': 'https://www.wykop.pl/ludzie/',
+}
+
+
+def _replace_href(match):
+    attr, quote, mark, name = match.groups()
+    return '{}{}{}{}{}'.format(attr, quote, HREF_URLS[mark], name, quote)
+
+
+def replace_hrefs(body_html):
+    """Rewrite every #tag/@user href to wykop url in one pass (only href values are changed)"""
+    if not body_html:
+        return body_html
+    return HREF_REGEX.sub(_replace_href, body_html)
 
 
 class JsonParser:
@@ -34,20 +109,12 @@ class JsonParser:
             self.entry.media_url = self.json_.get('embed', {}).get('url')
 
     def _parse_body_and_tags(self):
-        tags = []
         body_html = self.json_.get('body')
-        body = bs4.BeautifulSoup('<html>{}</html>'.format(body_html), 'html.parser')
-        hrefs = [a.get('href') for a in body.find_all('a')]
+        hrefs, body = parse_body(body_html)
+        tags = [href.strip('#') for href in hrefs if href and href.startswith('#')]
 
-        for href in hrefs:
-            if href.startswith('#'):
-                body_html = body_html.replace(href, 'https://www.wykop.pl/tag/{}'.format(href[1:]))
-                tags.append(href.strip('#'))
-            elif href.startswith('@'):
-                body_html = body_html.replace(href, 'https://www.wykop.pl/ludzie/{}'.format(href[1:]))
-
-        self.entry.body_html = body_html
-        self.entry.body = ''.join(body.find_all(text=True))
+        self.entry.body_html = replace_hrefs(body_html)
+        self.entry.body = body
         if tags:
             self.entry.tags = ' {} '.format(' '.join(tags))
         else:
@@ -62,9 +129,10 @@ class JsonParser:
                 self.entry.is_nsfw = True
 
     def parse(self):
-        self._parse_static()
-        self._parse_body_and_tags()
-        self._parse_nsfw()
+        with metrics.timer('parse'):
+            self._parse_static()
+            self._parse_body_and_tags()
+            self._parse_nsfw()
         return self.entry
 
 
@@ -161,7 +229,7 @@ class HtmlParser:
         self.EntryParserHelper = helper or SingleEntryHtmlParser
 
     def get_entries_soup_list(self):
-        soup = bs4.BeautifulSoup(self.html, 'html.parser')
+        soup = bs4.BeautifulSoup(self.html, get_bs4_features())
         soup = soup.find(class_='entry')
         if soup:
             soup = soup.find_all(class_='lcontrast')  # list of entry and comments
@@ -169,10 +237,9 @@ class HtmlParser:
 
     def get_main_entry(self):
         if self.soup_list:
-            self.EntryParserHelper(self.id_, self.soup_list[0]).parse()
             parser = self.EntryParserHelper(self.id_, self.soup_list[0])
             if parser.entry.id_:
-                return parser.parse()
+                return parser.parse()  # parse() mutates soup (decompose), so it runs once
             return None
 
     def get_comments_generator(self, start_index):
@@ -182,12 +249,12 @@ class HtmlParser:
                 if parser.entry.id_:
                     yield parser.parse()
                 else:
-                    raise StopIteration('Problem with comment parsing.')
+                    return  # problem with comment parsing
 
     @staticmethod
     def find_ids_in_html(page):
         ids = []
-        page_soup = bs4.BeautifulSoup(page, 'html.parser')
+        page_soup = bs4.BeautifulSoup(page, get_bs4_features())
         entries = page_soup.find_all(class_='entry iC ')
 
         for entry in entries:
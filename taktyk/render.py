@@ -1,6 +1,8 @@
 import logging
+import multiprocessing
 import os
 import time
+from collections import Counter
 
 try:
     import jinja2
@@ -8,15 +10,23 @@ except ImportError:
     logging.debug('ImportError - jinja2 - ' + __file__)
 
 from . import settings
-from .db import DB
+from .db import DB, split_tags
+
+# settings needed to render a single page in worker process
+PAGE_SETTINGS = ('USER_FILES_PATH', 'DB_DIR_NAME', 'DB_NAME', 'NSFW_FILTER', 'FILES_DIR_NAME',
+                 'NSFW_DIR_NAME', 'COMMENTS_DIR_NAME', 'TEMPLATES_PATH', 'TEMPLATE_NAME',
+                 'INDEX_TEMPLATE_NAME', 'HTML_BUFFER_SIZE')
 
 
 class HtmlFile:
-    def __init__(self, tag=None):
+    def __init__(self, tag=None, page_size=None, incremental=False):
         self.tag = tag
+        self.page_size = settings.HTML_PAGE_SIZE if page_size is None else page_size
+        self.incremental = incremental  # render only changed pages of paginated export
         self.user_files_path = settings.USER_FILES_PATH
         self.templates_path = settings.TEMPLATES_PATH
         self.template_name = settings.TEMPLATE_NAME
+        self.index_template_name = settings.INDEX_TEMPLATE_NAME
         self.file_name = None
 
     def create_file_name(self):
@@ -26,27 +36,119 @@ class HtmlFile:
     def get_full_path(self):
         return os.path.join(self.user_files_path, self.create_file_name())
 
-    def render(self, tags, entries):
+    @property
+    def pages_prefix(self):
+        if self.tag:
+            return 'taktyk-{}-strona'.format(self.tag)
+        return 'taktyk-strona'
+
+    def get_page_name(self, page):
+        return '{}-{}.html'.format(self.pages_prefix, page)
+
+    def get_index_name(self):
+        return '{}-index.html'.format(self.pages_prefix)
+
+    def get_template(self, template_name=None):
+        template_name = template_name or self.template_name
         env = jinja2.Environment(loader=jinja2.FileSystemLoader(self.templates_path))
         try:
-            template = env.get_template(self.template_name)
+            return env.get_template(template_name)
         except jinja2.exceptions.TemplateNotFound:
-            logging.critical('Nie odnaleziono pliku: %s', self.template_name)
+            logging.critical('Nie odnaleziono pliku: %s', template_name)
             raise SystemExit
-        else:
-            rendered = template.render(tags=tags, entries=entries)
-            rendered_bytes = rendered.encode('utf-8')
-            return rendered_bytes
+
+    def render(self, tags, entries):
+        rendered = self.get_template().render(tags=tags, entries=entries)
+        rendered_bytes = rendered.encode('utf-8')
+        return rendered_bytes
 
     def save(self, rendered_bytes):
         with open(self.get_full_path(), 'wb') as html_file:
             html_file.write(rendered_bytes)
 
+    def save_stream(self, tags, entries, full_path=None, template=None, **context):
+        """Render template chunk by chunk straight to the file, without building whole page"""
+        template = template or self.get_template()
+        full_path = full_path or self.get_full_path()
+        with open(full_path, 'wb', buffering=settings.HTML_BUFFER_SIZE) as html_file:
+            for chunk in template.generate(tags=tags, entries=entries, **context):
+                html_file.write(chunk.encode('utf-8'))
+
+    def render_page(self, page, pages_count):
+        with DB.Read() as cursor:
+            entries = list(DB.get_all_entries_with_comments(cursor, self.tag,
+                                                            page=(self.pages_prefix, page)))
+        page_name = self.get_page_name(page)
+        newer_page = self.get_page_name(page + 1) if page < pages_count else None
+        older_page = self.get_page_name(page - 1) if page > 1 else None
+        self.save_stream(count_entries_tags(entries), entries,
+                         full_path=os.path.join(self.user_files_path, page_name),
+                         page=page, index_name=self.get_index_name(),
+                         newer_page=newer_page, older_page=older_page)
+        return page_name
+
+    def render_pages(self, pages, pages_count):
+        processes = settings.HTML_PROCESSES or os.cpu_count() or 1
+        if processes == 1 or len(pages) <= 1:
+            return [self.render_page(page, pages_count) for page in pages]
+
+        page_settings = {name: getattr(settings, name) for name in PAGE_SETTINGS}
+        # spawned (not forked) workers - download threads may still be running
+        with multiprocessing.get_context('spawn').Pool(min(processes, len(pages))) as pool:
+            results = [pool.apply_async(render_page_in_process, (page_settings, self.tag,
+                                                                 self.page_size, page, pages_count))
+                       for page in pages]
+            return [result.get() for result in results]
+
+    def remove_stale_pages(self, pages_count):
+        page = pages_count + 1
+        while os.path.isfile(os.path.join(self.user_files_path, self.get_page_name(page))):
+            os.remove(os.path.join(self.user_files_path, self.get_page_name(page)))
+            page += 1
+
+    def create_pages(self):
+        logging.info('...tworzenie stron html')
+        export = self.pages_prefix
+        with DB.Connect() as cursor:
+            to_render, pages_count = DB.update_render_state(cursor, export, self.page_size,
+                                                            self.tag, reset=not self.incremental)
+            tags = DB.count_tags(cursor, self.tag)
+            pages = [(page, self.get_page_name(page), count, newest, oldest)
+                     for page, count, newest, oldest in DB.get_render_pages(cursor, export)]
+
+        missing = {page for page, page_name, *_ in pages
+                   if not os.path.isfile(os.path.join(self.user_files_path, page_name))}
+        to_render = sorted(to_render | missing)
+        try:
+            self.render_pages(to_render, pages_count)
+        except BaseException:
+            DB.reset_render_state(export)  # next export will render all pages again
+            raise
+
+        self.remove_stale_pages(pages_count)
+        self.file_name = self.get_index_name()
+        self.save_stream(tags, [], full_path=os.path.join(self.user_files_path, self.file_name),
+                         template=self.get_template(self.index_template_name), pages=pages)
+        logging.info('...utworzono strony html (%s/%s), spis: %s',
+                     len(to_render), pages_count, self.file_name)
+
     def create(self):
+        if self.page_size:
+            return self.create_pages()
         logging.info('...tworzenie pliku html')
-        with DB.Connect() as cursor:
+        with DB.Read() as cursor:
             tags = DB.count_tags(cursor, self.tag)
             entries = DB.get_all_entries_with_comments(cursor, self.tag)
-            rendered_bytes = self.render(tags, entries)
-            self.save(rendered_bytes)
+            self.save_stream(tags, entries)
         logging.info('...utworzono plik html: %s', self.file_name)
+
+
+def count_entries_tags(entries):
+    tags = Counter(tag for entry in entries for tag in set(split_tags(entry.tags)))
+    return sorted(tags.items(), key=lambda x: (-x[1], x[0]))
+
+
+def render_page_in_process(page_settings, tag, page_size, page, pages_count):
+    for name, value in page_settings.items():
+        setattr(settings, name, value)
+    return HtmlFile(tag=tag, page_size=page_size).render_page(page, pages_count)
@@ -1,18 +1,60 @@
 import logging
+import os
+import threading
 import traceback
 from json.decoder import JSONDecodeError
 
 try:
     import requests
+    from requests.adapters import HTTPAdapter
+    from requests.packages.urllib3.util.retry import Retry
 except ImportError:
     logging.debug('ImportError - requests - ' + __file__)
 
+from . import settings
+
+
+class EmptyListError(ValueError):
+    """Api returned empty list - e.g. page of favorites after the last one"""
+
 
 class Request:
+    _session = None
+    _session_pid = None
+    _session_lock = threading.Lock()
+
+    @classmethod
+    def get_session(cls):
+        """Shared requests.Session (keep-alive connection pool), created once per process"""
+        if cls._session is None or cls._session_pid != os.getpid():
+            with cls._session_lock:
+                if cls._session is None or cls._session_pid != os.getpid():
+                    cls._session = cls.create_session()
+                    cls._session_pid = os.getpid()
+        return cls._session
+
+    @staticmethod
+    def get_pool_size():
+        """Connections kept per host - fits max number of concurrent requests to one host"""
+        return settings.REQUEST_POOL_SIZE or max(settings.API_PAGES_WINDOW, settings.ENTRY_WORKERS,
+                                                 settings.DOWNLOAD_PER_HOST)
+
+    @staticmethod
+    def create_session():
+        retry = Retry(total=settings.REQUEST_RETRIES, backoff_factor=settings.REQUEST_BACKOFF,
+                      status_forcelist=(429, 500, 502, 503, 504), raise_on_status=False)
+        pool_size = Request.get_pool_size()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
     @classmethod
     def get(cls, url, exit_=False, msg=None, skip=False, **kwargs):
         try:
-            response = requests.get(url, **kwargs)
+            response = cls.get_session().get(url, **kwargs)
             response.raise_for_status()
         except requests.exceptions.ConnectionError:
             logging.critical('Brak połączenia z internetem')
@@ -53,5 +95,5 @@ class Request:
                 logging.debug(error_info)
                 raise ValueError(error_info)
             elif isinstance(json_, list) and not json_:
-                raise ValueError('Empty list')
+                raise EmptyListError('Empty list')
             return json_
@@ -1,11 +1,33 @@
+import hashlib
 import logging
-import multiprocessing
 import os
+import queue
+import shutil
+import threading
+import time
+import traceback
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlsplit
 
 from . import settings
+from .metrics import metrics
 from .request import Request
 
 
+_host_semaphores = defaultdict(lambda: threading.BoundedSemaphore(settings.DOWNLOAD_PER_HOST))
+_host_semaphores_lock = threading.Lock()
+
+
+@contextmanager
+def host_limit(url):
+    """Allow at most settings.DOWNLOAD_PER_HOST concurrent downloads from url's host"""
+    with _host_semaphores_lock:
+        semaphore = _host_semaphores[urlsplit(url).netloc]
+    with semaphore:
+        yield
+
+
 class Save:
     unsaved_file = 'niezapisane.txt'
     gfycat = 'gfycat.com/'
@@ -20,9 +42,24 @@ class Save:
         self.cwd = cwd or settings.USER_FILES_PATH
         self.gfycat_api = settings.GFYCAT_API
         self._ext = self.get_ext()
-        self.url = self.get_file_url()
+        self._url = None
+        self._url_resolved = False
+        self.store_path = os.path.join(self.cwd, settings.FILES_DIR_NAME,
+                                       settings.MEDIA_STORE_DIR_NAME)
         self.nsfw_consistent = not(settings.NSFW_FILTER and self.is_nsfw)
 
+    @property
+    def url(self):
+        """File url - resolved only when needed (gfycat url requires api request)"""
+        if not self._url_resolved:
+            self.url = self.get_file_url()
+        return self._url
+
+    @url.setter
+    def url(self, value):
+        self._url = value
+        self._url_resolved = True
+
     def get_path(self):
         full_path = os.path.join(self.cwd, self.dir_path)
         if os.path.exists(full_path):
@@ -59,31 +96,126 @@ class Save:
             file.write('{},{},{}\n'.format(self.id_, self.is_nsfw, self.media_url))
 
     def save(self):
-        if self.url and self.nsfw_consistent:
-            msg = self.msg + self.url
-            full_path = self.get_path()
-            if full_path:
-                if os.path.exists(full_path):
-                    logging.debug('File already exist')
-                    return True
-                return self.save_single_file(self.url, full_path, msg)
+        """
+        True - file saved, False - failed (download job is retried by --save),
+        None - file not saved on purpose (nsfw filter, unsupported file)
+        """
+        if not self.nsfw_consistent:
+            return None
+        if not (self.get_stored_file() or self.url):
+            return False if self._ext else None  # supported file - gfycat request failed
+        full_path = self.get_path()
+        if full_path:
+            if os.path.exists(full_path):
+                logging.debug('File already exist')
+                return True
+            stored_file = self.get_stored_file()
+            if stored_file:  # media_url already downloaded - no request needed
+                link_file(stored_file, full_path)
+                metrics.add('download_dedup')
+                return True
+            saved = self.save_single_file(self.url, full_path, self.msg + self.url)
+            if saved:
+                self.add_to_store(full_path)
+            return saved
+        else:
+            logging.debug('Path not found: %s', self.file_name)
+            return False
+
+    def get_url_key_path(self):
+        url_hash = hashlib.sha1(self.media_url.encode('utf-8')).hexdigest()
+        return os.path.join(self.store_path, 'url', url_hash)
+
+    def get_stored_file(self):
+        """Path of file downloaded before from media_url (by url index), None if not there"""
+        try:
+            with open(self.get_url_key_path(), encoding='utf-8') as file:
+                path = os.path.join(self.cwd, file.read().strip())
+        except (OSError, UnicodeDecodeError):
+            return None
+        return path if os.path.isfile(path) else None
+
+    def add_to_store(self, full_path):
+        """
+        Keep downloaded file in media store by content hash (hardlink - file with the same
+        content downloaded from other url is reused) and path of it in url index (small text
+        file by url hash), without hardlinks support nothing is stored - url index points to
+        full_path
+        """
+        try:
+            content_path = os.path.join(self.store_path, 'content',
+                                        file_hash(full_path) + (self._ext or ''))
+            url_key_path = self.get_url_key_path()
+            for path in (content_path, url_key_path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.isfile(content_path):
+                link_file(content_path, full_path)
             else:
-                logging.debug('Path not found: %s', self.file_name)
-                return False
+                try:
+                    os.link(full_path, content_path)
+                except OSError:  # no copy of file in media store
+                    content_path = full_path
+            tmp_path = url_key_path + settings.DOWNLOAD_PART_EXT
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                file.write(os.path.relpath(content_path, self.cwd))
+            os.replace(tmp_path, url_key_path)
+        except OSError as err:  # file is saved anyway, only deduplication failed
+            logging.debug('Media store: %s %s', full_path, err)
 
     @staticmethod
     def save_single_file(url, full_path, msg=''):
-        response = Request.get(url, exit_=False, msg=msg, stream=True)
+        """
+        Download into temporary part file and rename it to full_path when complete,
+        download of existing part file (interrupted before) is resumed with HTTP Range,
+        only if remote file didn't change since (If-Range)
+        """
+        with host_limit(url):
+            return Save._download(url, full_path, msg)
+
+    @staticmethod
+    def _download(url, full_path, msg=''):
+        part_path = full_path + settings.DOWNLOAD_PART_EXT
+        validator_path = part_path + settings.DOWNLOAD_VALIDATOR_EXT
+        offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        validator = read_validator(validator_path) if offset else None
+        start = time.monotonic()
+        response = None
+        if validator:  # part file of unknown version is not resumed
+            headers = {'Range': 'bytes={}-'.format(offset), 'If-Range': validator}
+            response = Request.get(url, exit_=False, skip=True, stream=True, headers=headers)
+        if response is None or response.status_code != 206:  # whole file (changed/range ignored)
+            offset = 0
+        if response is None:
+            response = Request.get(url, exit_=False, msg=msg, skip=True, stream=True)
         try:
-            response_gen = response.iter_content(1024)
+            response_gen = response.iter_content(settings.DOWNLOAD_CHUNK_SIZE)
+            length = response.headers.get('Content-Length')
         except AttributeError:
             return False
+        if not offset:
+            write_validator(validator_path, get_validator(response))
 
-        with open(full_path, 'wb') as file:
-            for chunk in response_gen:
-                if chunk:
-                    file.write(chunk)
-            return True
+        try:
+            with open(part_path, 'ab' if offset else 'wb') as file:
+                for chunk in response_gen:
+                    if chunk:
+                        file.write(chunk)
+        except OSError as err:  # includes requests exceptions - part file is kept for resume
+            logging.debug('%s %s', url, err)
+            return False
+        finally:
+            response.close()
+            metrics.add('download', 0, time.monotonic() - start,
+                        max(os.path.getsize(part_path) - offset, 0)
+                        if os.path.isfile(part_path) else 0)
+
+        if length and os.path.getsize(part_path) != offset + int(length):
+            logging.debug('Incomplete file: %s', url)
+            return False
+        os.replace(part_path, full_path)
+        write_validator(validator_path, None)
+        metrics.add('download')
+        return True
 
     @staticmethod
     def save_text_file(url, full_path, msg=''):
@@ -100,23 +232,83 @@ class Save:
             return True
 
 
+def file_hash(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(settings.DOWNLOAD_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_validator(response):
+    """Strong ETag or Last-Modified of response (If-Range doesn't accept weak ETag), None if none"""
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+def read_validator(path):
+    try:
+        with open(path, encoding='utf-8') as file:
+            return file.read().strip() or None
+    except OSError:
+        return None
+
+
+def write_validator(path, validator):
+    """Keep validator of part file in path, remove path when validator is None"""
+    try:
+        if validator:
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(validator)
+        elif os.path.isfile(path):
+            os.remove(path)
+    except OSError as err:  # part file won't be resumed
+        logging.debug('%s %s', path, err)
+
+
+def link_file(src, dst):
+    """Atomically make dst a hardlink of src (copy if filesystem doesn't support hardlinks)"""
+    tmp_path = dst + settings.DOWNLOAD_PART_EXT
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
 def save_wrapper(download_info_dict, kwargs):
     return Save(**download_info_dict, **kwargs).save()
 
 
 class Multi:
-    def __init__(self, count, func, end_clause='end', **func_kwargs):
+    """
+    Pool of count threads calling func(value, func_kwargs) for every value put (I/O bound work),
+        on_result - called in this thread with [(value, result), ...] of finished calls,
+        queue_size - put() waits when that many values are waiting for threads (0 - no limit)
+    """
+    def __init__(self, count, func, end_clause='end', on_result=None, queue_size=0,
+                 **func_kwargs):
         self.count = count
         self.func = func
-        self.queue = multiprocessing.JoinableQueue()
+        self.queue = queue.Queue(queue_size)
+        self.results = queue.Queue()
         self.end_clause = end_clause
+        self.on_result = on_result
         self.func_kwargs = func_kwargs
+        self.threads = []
 
     def __enter__(self):
         for _ in range(self.count):
-            p = multiprocessing.Process(target=self._target,
-                                        args=(self.queue, self.func, self.end_clause, self.func_kwargs))
-            p.start()
+            thread = threading.Thread(target=self._target,
+                                      args=(self.queue, self.results, self.func, self.end_clause,
+                                            self.func_kwargs),
+                                      daemon=True)  # unfinished jobs are resumed by --save
+            thread.start()
+            self.threads.append(thread)
         return self
 
     def __exit__(self, tp, v, tb):
@@ -124,18 +316,42 @@ class Multi:
             self.queue.put(self.end_clause)
 
     @staticmethod
-    def _target(queue, func, end_clause, func_kwargs):
+    def _target(queue_, results, func, end_clause, func_kwargs):
         while True:
-            args = queue.get()
-            queue.task_done()
+            args = queue_.get()
+            queue_.task_done()
             if args == end_clause:
                 break
-            func(args, func_kwargs)
+            try:
+                result = func(args, func_kwargs)
+            except BaseException:  # also SystemExit - thread has to keep taking values
+                logging.debug(traceback.format_exc())
+                result = False
+            results.put((args, result))
 
     def put(self, value):
         self.queue.put(value)
+        metrics.gauge('download_queue', self.queue.qsize())
+        self.collect()
+
+    def collect(self, timeout=None):
+        """Pass finished results to on_result, waits up to timeout for the first one"""
+        finished = []
+        try:
+            finished.append(self.results.get(timeout=timeout) if timeout else
+                            self.results.get_nowait())
+            while True:
+                finished.append(self.results.get_nowait())
+        except queue.Empty:
+            pass
+        if finished and self.on_result:
+            self.on_result(finished)
+        return finished
 
     def join(self):
         if self.count:
-            self.queue.join()
+            for thread in self.threads:
+                while thread.is_alive():
+                    self.collect(timeout=0.5)
+            self.collect()
             logging.info('...pobieranie plików zakończone')
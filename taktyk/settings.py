@@ -16,6 +16,7 @@ EXTS = []  # will be set by utils.ConfigFile. Default exts: ['.gif', '.jpg', '.j
 
 DB_NAME = 'taktyk.db'
 TEMPLATE_NAME = 'template.html'
+INDEX_TEMPLATE_NAME = 'index.html'
 USERKEY_FILE = 'userkey.txt'
 CONFIG_FILE = 'config.ini'
 
@@ -54,6 +55,7 @@ DB_DIR_NAME = 'db'
 FILES_DIR_NAME = 'pliki'
 COMMENTS_DIR_NAME = 'komentarze'
 NSFW_DIR_NAME = 'nsfw'
+MEDIA_STORE_DIR_NAME = '.magazyn'  # inside FILES_DIR_NAME, files by content hash, url index
 SELENIUM_DRIVER_DIR_NAME = 'seleniumdrivers'
 TEMPLATE_DIR_NAME = 'templates'
 
@@ -82,7 +84,88 @@ FULL_UPDATE = False
 SKIP_FILES = False
 BROWSER = None
 NSFW_FILTER = False
-DB_IDS = []
+DB_IDS = set()  # ids of entries in database (and added during run)
+DB_COMMENTS_COUNTS = None  # {entry_id: comments count} preloaded for FULL_UPDATE
+
+# shared requests.Session - connections kept per host and retries with exponential backoff
+# for 429/5xx responses. Pool has to fit concurrent requests to one host, otherwise urllib3
+# discards connections (warning "Connection pool is full"), None - max of API_PAGES_WINDOW,
+# ENTRY_WORKERS and DOWNLOAD_PER_HOST:
+REQUEST_POOL_SIZE = None
+REQUEST_RETRIES = 3
+REQUEST_BACKOFF = 0.5
+
+# threads requesting entries by ids, max number of entries requested and waiting to be processed:
+ENTRY_WORKERS = 5
+FUTURES_WINDOW = 50
+
+# favorites pages requested concurrently - window starts small and adapts to latency
+# and api errors up to API_PAGES_WINDOW (page slower than average * SLOW_FACTOR shrinks it):
+API_PAGES_WINDOW = 16
+API_PAGES_WINDOW_START = 2
+API_PAGES_SLOW_FACTOR = 2
+
+# entry body (api) parser: 'tokenizer' - html.parser tokenizer, 'bs4' - BeautifulSoup tree
+BODY_PARSER = 'tokenizer'
+# bs4 tree builder for scraped pages - 'lxml' is faster, but entries parsed by it can differ
+# (block elements in body are cut off, \r\n becomes \n):
+HTML_PARSER = 'html.parser'
+
+# processes parsing scraped html (None - cpu count, 1 - parse in main process):
+PARSE_PROCESSES = None
+
+# asyncio (aiohttp) content delivery - max requests in flight (pages of favorites limited separately):
+ASYNC = False
+ASYNC_LIMIT = 100
+ASYNC_PAGES_LIMIT = 10
+
+# pipeline stages run concurrently, connected by bounded queues: fetch (thread, ASYNC_LIMIT or
+# API_PAGES_WINDOW requests) -> parse (PARSE_PROCESSES) -> store (DB.QueueWriter thread,
+# DB_WRITE_QUEUE_SIZE) -> download (DOWNLOAD_WORKERS threads). Raw entries fetched ahead of
+# parsing and files waiting for download workers:
+FETCH_QUEUE_SIZE = 100
+DOWNLOAD_QUEUE_SIZE = 1000
+
+# media downloads - threads sharing requests.Session and max concurrent downloads per host
+# (DOWNLOAD_PER_HOST is within REQUEST_POOL_SIZE connections kept per host):
+DOWNLOAD_WORKERS = 20
+DOWNLOAD_PER_HOST = 6
+
+# media files are streamed in chunks into <file>.part, renamed when download is complete:
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_PART_EXT = '.part'
+# ETag or Last-Modified of file being downloaded, kept in <file>.part.id - resumed download
+# is sent with If-Range, so changed remote file is downloaded again from the start:
+DOWNLOAD_VALIDATOR_EXT = '.id'
+
+# download job is retried by --save until it is done or failed this many times:
+DOWNLOAD_MAX_ATTEMPTS = 3
+
+# --metrics - stage counters/timings shown with progress and saved as json when program ends:
+METRICS = False
+METRICS_FILE = os.path.join(USER_FILES_PATH, 'metryki.json')
+
+# how many entries/comments are buffered before executemany() insert:
+DB_BATCH_SIZE = 500
+
+# sqlite - WAL journal, synchronous mode, page cache (KiB) and busy timeout (s) of connections,
+# idle read connections kept by DB.ReadPool, entries waiting for writer thread
+# and seconds without new entries after which writer thread commits its batch:
+DB_WAL = True
+DB_SYNCHRONOUS = 'NORMAL'
+DB_CACHE_SIZE = 20000
+DB_TIMEOUT = 30
+DB_READ_POOL_SIZE = 4
+DB_WRITE_QUEUE_SIZE = 1000
+DB_FLUSH_INTERVAL = 1.0
+
+# write buffer size (bytes) used while streaming rendered html to file:
+HTML_BUFFER_SIZE = 65536
+
+# paginated html export - entries per page (0 - single html file)
+# and number of worker processes rendering pages (None - cpu count):
+HTML_PAGE_SIZE = 0
+HTML_PROCESSES = None
 
 # for tracking how many entries and comments were added:
 ENTRIES_ADDED = 0
@@ -10,7 +10,7 @@ try:
 except ImportError:
     logging.debug('ImportError - selenium - ' + __file__)
 
-from . import settings
+from . import asynccontent, settings
 from .auth import set_userkey, log_in_for_session
 from .contentdelivery import ApiContent, HtmlContent
 from .parsers import HtmlParser
@@ -22,10 +22,29 @@ class Strategy(metaclass=abc.ABCMeta):
         pass
 
     @staticmethod
-    def get_content_by_ids(ids):
+    def use_async():
+        if settings.ASYNC and not asynccontent.is_available():
+            logging.warning('Brak modułu aiohttp - wpisy zostaną pobrane bez asyncio.')
+            settings.ASYNC = False
+        return settings.ASYNC
+
+    @classmethod
+    def get_api_content(cls, **kwargs):
+        if cls.use_async():
+            return asynccontent.AsyncApiContent(**kwargs)
+        return ApiContent(**kwargs)
+
+    @classmethod
+    def get_html_content(cls):
+        if cls.use_async():
+            return asynccontent.AsyncHtmlContent()
+        return HtmlContent()
+
+    @classmethod
+    def get_content_by_ids(cls, ids):
         if settings.SCRAPE:
-            return HtmlContent().gen_html_entries_by_ids(ids)
-        return ApiContent().gen_entries_by_ids(ids)
+            return cls.get_html_content().gen_html_entries_by_ids(ids)
+        return cls.get_api_content().gen_entries_by_ids(ids)
 
     @staticmethod
     def scrape_pages_for_ids(username, get_page_func):
@@ -51,7 +70,7 @@ class APIStrategy(Strategy):
         logging.info('...rozpoczęcie uwierzytelniania')
         set_userkey()
         logging.info('...pobieranie numerów id i generowanie wpisów')
-        return ApiContent(userkey=settings.USERKEY).gen_entries()
+        return self.get_api_content(userkey=settings.USERKEY).gen_entries()
 
 
 class SourceStrategy(Strategy):
@@ -1,10 +1,13 @@
 import configparser
 import logging
 import os
+import queue
 import shutil
+import threading
 import traceback
 
 from . import settings
+from .metrics import metrics
 
 
 class CustomFormatter(logging.Formatter):
@@ -127,6 +130,52 @@ def unpack_archive(file, extract_dir, format_, msg):
         raise SystemExit
 
 
+def gen_prefetched(iterable, maxsize, name=None):
+    """
+    Iterate over iterable in separate thread - stage of pipeline running at most maxsize items
+    ahead of consumer, so e.g. fetching doesn't wait while entries are parsed and stored
+        Items are yielded in order, exception (also SystemExit) of iterable is raised here,
+        iterable is stopped and closed when consumer stops. name - queue depth metric name.
+    """
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+    end = object()
+    errors = []
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put(item):
+                    break
+        except BaseException as err:
+            errors.append(err)
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+            put(end)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        for item in iter(items.get, end):
+            if name:
+                metrics.gauge(name, items.qsize())
+            yield item
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
+
+
 class ConfigFile:
     template = [
         ['DANE LOGOWANIA', [
@@ -23,6 +23,7 @@ class ParseTest(unittest.TestCase):
             ('session', False),
             ('skip', False),
             ('scrape', False),
+            ('pages', None),
             ('DBHandler', True),
             ('delete', None),
             ('html', False),
@@ -135,6 +136,21 @@ class ParseTest(unittest.TestCase):
         parsed = _parse(static_args=['--scrape'])
         self.assertEqual(parsed['scrape'], True)
 
+    def test_pages_arg(self):
+        parsed = _parse(static_args=['--pages', '500'])
+        self.assertEqual(parsed['pages'], 500)
+
+    def test_asyncio_arg_when_limit_not_positive(self):
+        self.assertEqual(20, _parse(static_args=['--asyncio', '20'])['asyncio'])
+        for value in ('0', '-5'):
+            with self.assertRaises(SystemExit):
+                _parse(static_args=['--asyncio', value])
+
+    def test_pages_arg_when_not_positive(self):
+        for value in ('0', '-5', 'abc'):
+            with self.assertRaises(SystemExit):
+                _parse(static_args=['--pages', value])
+
     def test_html_arg(self):
         parsed = _parse(static_args=['--html'])
         self.assertEqual(parsed['html'], True)
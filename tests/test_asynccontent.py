@@ -0,0 +1,158 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from unittest.mock import patch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(os.path.abspath(__file__)))))
+
+from taktyk import asynccontent, settings
+from taktyk.contentdelivery import ApiContent, HtmlContent
+from taktyk.strategies import Strategy
+
+
+class GenResultsTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def tearDown(self):
+        self.loop.close()
+
+    async def coro(self, value):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.001 * (value % 3))
+        self.in_flight -= 1
+        return value
+
+    def test_if_all_true_results_returned(self):
+        coros = (self.coro(value) for value in range(20))
+        result = set(asynccontent.gen_results(self.loop, coros, 5))
+        self.assertEqual(set(range(1, 20)), result)
+
+    def test_if_limit_respected(self):
+        coros = (self.coro(value) for value in range(50))
+        list(asynccontent.gen_results(self.loop, coros, 7))
+        self.assertEqual(7, self.max_in_flight)
+
+    def test_if_pending_cancelled_when_generator_closed(self):
+        cancelled = []
+
+        async def slow_coro(value):
+            try:
+                await asyncio.sleep(value)
+            except asyncio.CancelledError:
+                cancelled.append(value)
+                raise
+            return value
+
+        gen = asynccontent.gen_results(self.loop, (slow_coro(v) for v in (0.001, 10, 10)), 10)
+        next(gen)
+        gen.close()
+        self.assertEqual([10, 10], cancelled)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.strip('/').split('/')
+        if path[0] == 'page':
+            page = int(path[1])
+            if page == 2 and self.server.page_failures:
+                self.server.page_failures -= 1
+                self.send_response(503)
+                self.end_headers()
+                self.wfile.write(b'busy')
+                return
+            body = json.dumps([{'id': page}] if page <= 3 else [])
+        elif path[0] == 'entry':
+            body = json.dumps({'id': int(path[1])}) if path[1] != '404' else '{"error": "x"}'
+        else:
+            body = '<html>{}</html>'.format(path[1])
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipUnless(asynccontent.is_available(), 'aiohttp not installed')
+class AsyncContentTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.url = 'http://127.0.0.1:{}/'.format(cls.server.server_address[1])
+        cls.server.page_failures = 0
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.content = asynccontent.AsyncApiContent(appkey='a', userkey='u', secret='s', limit=4)
+        self.content.fav_url = self.url + 'page/'
+        self.content.entry_url = self.url + 'entry/{index}'
+
+    def test_gen_entries(self):
+        result = list(self.content.gen_entries())
+        self.assertEqual([[{'id': 1}], [{'id': 2}], [{'id': 3}]],
+                         sorted(result, key=lambda x: x[0]['id']))
+
+    @patch('taktyk.asynccontent.settings.REQUEST_BACKOFF', 0)
+    def test_gen_entries_when_page_in_the_middle_failed_check_if_retried(self):
+        self.server.page_failures = 2
+        result = list(self.content.gen_entries())
+        self.assertEqual([[{'id': 1}], [{'id': 2}], [{'id': 3}]],
+                         sorted(result, key=lambda x: x[0]['id']))
+
+    @patch('taktyk.asynccontent.settings.REQUEST_BACKOFF', 0)
+    @patch('taktyk.asynccontent.settings.REQUEST_RETRIES', 1)
+    def test_gen_entries_when_page_failed_too_many_times_check_if_last(self):
+        self.server.page_failures = 2
+        result = list(self.content.gen_entries())
+        self.assertIn([{'id': 1}], result)
+        self.assertNotIn([{'id': 2}], result)
+        self.server.page_failures = 0
+
+    def test_gen_entries_by_ids(self):
+        result = list(self.content.gen_entries_by_ids(['1', '2', '404']))
+        self.assertEqual([{'id': 1}, {'id': 2}], sorted(result, key=lambda x: x['id']))
+
+    def test_gen_html_entries_by_ids(self):
+        content = asynccontent.AsyncHtmlContent(limit=2)
+        content.entry_url = self.url + 'html/'
+        result = set(content.gen_html_entries_by_ids(['1', '2', '3']))
+        self.assertEqual({(id_, '<html>{}</html>'.format(id_)) for id_ in '123'}, result)
+
+
+class StrategyContentTest(unittest.TestCase):
+    def tearDown(self):
+        settings.ASYNC = False
+
+    def test_when_async_off(self):
+        self.assertIs(ApiContent, type(Strategy.get_api_content()))
+        self.assertIs(HtmlContent, type(Strategy.get_html_content()))
+
+    @patch('taktyk.strategies.asynccontent.is_available', return_value=True)
+    def test_when_async_on(self, _):
+        settings.ASYNC = True
+        self.assertIsInstance(Strategy.get_api_content(), asynccontent.AsyncApiContent)
+        self.assertIsInstance(Strategy.get_html_content(), asynccontent.AsyncHtmlContent)
+
+    @patch('taktyk.strategies.asynccontent.is_available', return_value=False)
+    def test_when_async_on_but_aiohttp_missing(self, _):
+        settings.ASYNC = True
+        self.assertIs(ApiContent, type(Strategy.get_api_content()))
+        self.assertFalse(settings.ASYNC)
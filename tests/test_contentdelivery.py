@@ -1,11 +1,15 @@
+import itertools
 import os
 import sys
+import time
 import unittest
 from unittest.mock import patch, Mock
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(os.path.abspath(__file__)))))
 
-from taktyk.contentdelivery import HtmlContent, ApiContent, gen_entries_by_ids_with_futures
+from taktyk.contentdelivery import (HtmlContent, ApiContent, PagesWindow,
+                                   gen_entries_by_ids_with_futures)
+from taktyk.request import EmptyListError
 
 
 class GenEntriesByIdsWithFuturesTest(unittest.TestCase):
@@ -24,6 +28,28 @@ class GenEntriesByIdsWithFuturesTest(unittest.TestCase):
         test_gen = gen_entries_by_ids_with_futures(test_func, ids=ids, max_workers=3)
         self.assertEqual(len(list(test_gen)), 2)
 
+    def test_if_window_limits_calls_in_flight(self):
+        calls = []
+
+        def test_func(id_):
+            calls.append(id_)
+            return id_ + 1
+        test_gen = gen_entries_by_ids_with_futures(test_func, ids=itertools.count(),
+                                                   max_workers=2, window=4)
+        for consumed in range(1, 11):
+            next(test_gen)
+            self.assertLessEqual(len(calls), consumed + 4)
+        test_gen.close()
+
+    def test_if_ordered_results_keep_order_of_ids(self):
+        def test_func(id_):
+            time.sleep(0.001 * (id_ % 4))
+            return id_
+        ids = list(range(1, 30))
+        test_gen = gen_entries_by_ids_with_futures(test_func, ids=ids, max_workers=4, window=6,
+                                                   ordered=True)
+        self.assertEqual(ids, list(test_gen))
+
 
 class ApiContentTest(unittest.TestCase):
     def setUp(self):
@@ -67,22 +93,50 @@ class ApiContentTest(unittest.TestCase):
         self.mock_get_json.return_value = 'somejson'
         self.assertEqual('somejson', self.content.get_json(self.content.fav_url))
 
-    def test_submit_to_executor_when_page_is_not_none(self):
-        mock_executor = Mock()
-        mock_submit = Mock(return_value='future')
-        mock_executor.submit = mock_submit
-        self.assertEqual('future', self.content.submit_to_executor(mock_executor))
-        mock_submit.assert_called_with(self.content.get_json, self.content.fav_url)
-        self.assertEqual(1, self.content.page_num)  # checking if page_num_incremented
+    def test_get_fav_page_when_api_error(self):
+        self.mock_get_json.side_effect = ValueError({'code': 5})
+        with self.assertRaises(ValueError):
+            self.content.get_fav_page(1)
+
+    def test_get_fav_page_when_page_empty(self):
+        self.mock_get_json.side_effect = EmptyListError('Empty list')
+        self.assertEqual([], self.content.get_fav_page(3)[0])
 
-    def test_submit_to_executor_when_page_is_none(self):
-        self.content.page_num = None
-        self.assertFalse(self.content.submit_to_executor(Mock()))
+    def test_get_fav_page_if_correct_url(self):
+        self.content.fav_url = 'fav_url'
+        self.assertEqual({'json': 'content'}, self.content.get_fav_page(7)[0])
+        self.mock_get_json.assert_called_with('fav_url7', exit_=False, headers='md5')
 
     def test_gen_entries_if_correct_incrementing_and_output(self):
-        return_lst = ['resul1', 'result2', 'result3', []]
-        self.mock_get_json.side_effect = return_lst
-        self.assertEqual(return_lst[:3], list(self.content.gen_entries()))
+        self.mock_get_json.side_effect = lambda url, **_: [url[-1]] if url[-1] in '123' else []
+        self.assertEqual([['1'], ['2'], ['3']], sorted(self.content.gen_entries()))
+
+    def test_gen_entries_if_pages_past_last_are_not_requested(self):
+        self.content.fav_url = 'fav_url/'
+        self.mock_get_json.side_effect = lambda url, **_: [] if int(url.split('/')[-1]) > 5 else [1]
+        window = PagesWindow(size=4, max_size=4)
+        self.assertEqual(5, len(list(self.content.gen_entries(window))))
+        requested = [int(call[0][0].split('/')[-1]) for call in self.mock_get_json.call_args_list]
+        self.assertLessEqual(max(requested), 5 + window.max_size)
+
+    @patch('taktyk.contentdelivery.settings.REQUEST_BACKOFF', 0)
+    def test_gen_entries_when_page_failed_check_if_retried(self):
+        self.mock_get_json.side_effect = [['1'], ValueError, ['2'], []]
+        self.assertEqual([['1'], ['2']], list(self.content.gen_entries(PagesWindow(1, 1))))
+
+    @patch('taktyk.contentdelivery.settings.REQUEST_BACKOFF', 0)
+    @patch('taktyk.contentdelivery.settings.REQUEST_RETRIES', 1)
+    def test_gen_entries_when_page_failed_too_many_times_check_if_last(self):
+        self.mock_get_json.side_effect = [['1'], ValueError, ValueError('limit'), ['3'], []]
+        self.assertEqual([['1']], list(self.content.gen_entries(PagesWindow(1, 1))))
+        self.assertEqual(3, self.mock_get_json.call_count)
+
+    @patch('taktyk.contentdelivery.settings.REQUEST_BACKOFF', 0)
+    @patch('taktyk.contentdelivery.settings.REQUEST_RETRIES', 1)
+    def test_gen_entries_when_api_error_on_every_page_check_if_stopped(self):
+        self.mock_get_json.side_effect = ValueError('limit')
+        self.assertEqual([], list(self.content.gen_entries(PagesWindow(size=4, max_size=4))))
+        self.assertLess(self.mock_get_json.call_count, 20)
 
     def test_gen_entries_with_ids_if_correct_output(self):
         return_lst = ['resul1', 'result2', 'result3', [], 'result5']
@@ -92,6 +146,28 @@ class ApiContentTest(unittest.TestCase):
         self.assertEqual(expected_result, set(self.content.gen_entries_by_ids(ids)))
 
 
+class PagesWindowTest(unittest.TestCase):
+    def setUp(self):
+        self.window = PagesWindow(size=4, max_size=6)
+
+    def test_success_grows_up_to_max_size(self):
+        for _ in range(5):
+            self.window.success(1)
+        self.assertEqual(6, self.window.size)
+
+    def test_slow_page_shrinks(self):
+        self.window.success(1)
+        self.window.success(10)
+        self.assertEqual(4, self.window.size)
+
+    def test_failure_halves_but_not_below_one(self):
+        self.window.failure()
+        self.assertEqual(2, self.window.size)
+        for _ in range(3):
+            self.window.failure()
+        self.assertEqual(1, self.window.size)
+
+
 class HtmlContentTest(unittest.TestCase):
     def setUp(self):
         self.content = HtmlContent()
@@ -2,13 +2,14 @@ import os
 import shutil
 import sys
 import sqlite3
+import threading
 import unittest
 from unittest.mock import patch, Mock
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(os.path.abspath(__file__)))))
 
 from taktyk.entry import Entry
-from taktyk.db import DB, database_list, set_added_info
+from taktyk.db import DB, MIGRATIONS, database_list, set_added_info
 from taktyk import settings
 
 
@@ -63,6 +64,58 @@ class DBCreationTest(Prepare):
         connection.execute('SELECT * FROM entry_comment')
 
 
+class MigrateTest(Prepare):
+    def setUp(self):
+        super().setUp()
+        self.db_path = os.path.join(self.path, 'old.db')
+        settings.DB_NAME = 'old.db'
+        connection = sqlite3.connect(self.db_path)
+        connection.execute('''CREATE TABLE entry (
+                                id INTEGER(20) NOT NULL PRIMARY KEY, author VARCHAR(80) NOT NULL,
+                                date VARCHAR(20) NOT NULL, body LONGTEXT, body_html LONGTEXT,
+                                url VARCHAR(40) NOT NULL, plus VARCHAR(5) NOT NULL,
+                                media_url VARCHAR(255), tags VARCHAR(255),
+                                is_nsfw BOOLEAN NOT NULL, entry_id INTEGER(20))''')
+        connection.execute('''CREATE TABLE entry_comment (
+                                id INTEGER(20) NOT NULL PRIMARY KEY, author VARCHAR(80) NOT NULL,
+                                date VARCHAR(20) NOT NULL, body LONGTEXT, body_html LONGTEXT,
+                                url VARCHAR(40) NOT NULL, plus VARCHAR(5) NOT NULL,
+                                media_url VARCHAR(255), tags VARCHAR(255),
+                                is_nsfw BOOLEAN NOT NULL, entry_id INTEGER(20) NOT NULL)''')
+        connection.execute('INSERT INTO entry VALUES (?,?,?,?,?,?,?,?,?,?,?)', tuple(self.entry))
+        connection.commit()
+        connection.close()
+
+    def test_if_old_database_upgraded_in_place(self):
+        DB.migrate()
+        connection = sqlite3.connect(self.db_path)
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        indexes = {row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()}
+        tags = connection.execute('SELECT entry_id, tag FROM entry_tag').fetchall()
+        connection.close()
+        self.assertEqual(len(MIGRATIONS), version)
+        self.assertTrue({'entry_date_idx', 'entry_comment_entry_id_idx'} <= indexes)
+        self.assertEqual([(1, 'testtag1')], tags)
+
+    def test_if_download_jobs_backfilled(self):
+        DB.migrate()
+        jobs = DB.get_download_jobs()
+        self.assertEqual([self.entry.download_info()], jobs)
+
+    def test_if_migrate_is_idempotent(self):
+        DB.migrate()
+        DB.migrate()
+        self.assertEqual([('testtag1', 1)], DB.count_tags())
+
+    def test_if_new_database_is_up_to_date(self):
+        DB.create_new('test')
+        connection = sqlite3.connect(os.path.join(self.path, 'test.db'))
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        connection.close()
+        self.assertEqual(len(MIGRATIONS), version)
+
+
 class InsertOneTest(Prepare):
     def setUp(self):
         super().setUp()
@@ -99,6 +152,178 @@ class InsertOneTest(Prepare):
             self.assertFalse(DB.insert_one(cursor, self.entry))
 
 
+class WriterTest(Prepare):
+    def setUp(self):
+        super().setUp()
+        DB.create_new('test')
+
+    def test_when_object_passed_is_none(self):
+        with DB.Connect() as cursor, DB.Writer(cursor) as writer:
+            self.assertFalse(writer.add(None))
+
+    def test_if_batch_flushed_when_full(self):
+        with DB.Connect() as cursor:
+            writer = DB.Writer(cursor, batch_size=2)
+            writer.add(Entry(*self.entry, type_='entry'))
+            self.assertEqual(0, settings.ENTRIES_ADDED)
+            self.entry.id_ = 2
+            writer.add(Entry(*self.entry, type_='entry'))
+            self.assertEqual(2, settings.ENTRIES_ADDED)
+            self.assertEqual({1, 2}, set(DB.get_ids(cursor, 'entry')))
+
+    def test_if_rest_flushed_on_exit(self):
+        with DB.Connect() as cursor:
+            with DB.Writer(cursor, batch_size=10) as writer:
+                writer.add(Entry(*self.entry, type_='entry'))
+                self.entry.id_ = 2
+                self.entry.entry_id = 1
+                writer.add(Entry(*self.entry, type_='entry_comment'))
+            self.assertEqual([1], DB.get_ids(cursor, 'entry'))
+            self.assertEqual([2], DB.get_ids(cursor, 'entry_comment'))
+        self.assertEqual(1, settings.ENTRIES_ADDED)
+        self.assertEqual(1, settings.COMMENTS_ADDED)
+
+    def test_if_duplicates_reported_per_row(self):
+        with DB.Connect() as cursor:
+            DB.insert_one(cursor, self.entry)
+            settings.ENTRIES_ADDED = 0
+            with DB.Writer(cursor, batch_size=10) as writer:
+                for id_ in (1, 2, 3):
+                    self.entry.id_ = id_
+                    writer.add(Entry(*self.entry, type_='entry'))
+            self.assertEqual({1, 2, 3}, set(DB.get_ids(cursor, 'entry')))
+        self.assertEqual(2, settings.ENTRIES_ADDED)
+
+    def test_if_flushed_rows_are_committed(self):
+        with DB.Connect() as cursor:
+            writer = DB.Writer(cursor, batch_size=1)
+            writer.add(self.entry)
+            connection = sqlite3.connect(os.path.join(self.path, 'test.db'))
+            rows = connection.execute('SELECT id FROM entry').fetchall()
+            connection.close()
+        self.assertEqual([(1,)], rows)
+
+
+class QueueWriterTest(Prepare):
+    def setUp(self):
+        super().setUp()
+        DB.create_new('test')
+
+    def test_if_entries_inserted_by_writer_thread(self):
+        with DB.QueueWriter(batch_size=2) as writer:
+            for id_ in (1, 2, 3):
+                self.entry.id_ = id_
+                self.assertTrue(writer.add(Entry(*self.entry, type_='entry')))
+            self.assertFalse(writer.add(None))
+        self.assertEqual({1, 2, 3}, set(DB.get_ids('entry')))
+        self.assertEqual(3, settings.ENTRIES_ADDED)
+
+    def test_if_call_executed_in_order_in_writer_thread(self):
+        infos = [{'id_': '1', 'media_url': 'u', 'is_nsfw': False, 'local_file_path': 'p.jpg'}]
+        threads = []
+
+        def record_thread(cursor, *args):
+            threads.append(threading.current_thread())
+            return DB.finish_download_jobs(cursor, *args)
+
+        with DB.QueueWriter() as writer:
+            writer.add(self.entry)
+            writer.call(DB.add_download_jobs, infos, True)
+            writer.call(record_thread, [(infos[0], True)])
+        self.assertEqual([writer.thread], threads)
+        self.assertEqual({'done': 1}, DB.count_download_jobs())
+        self.assertEqual([1], DB.get_ids('entry'))
+
+    def test_if_download_jobs_inserted_in_batch_before_calls(self):
+        infos = [{'id_': str(id_), 'media_url': 'u', 'is_nsfw': False, 'local_file_path': 'p.jpg'}
+                 for id_ in range(1, 4)]
+        with patch('taktyk.db.DB.add_download_jobs', wraps=DB.add_download_jobs) as mock_add:
+            with DB.QueueWriter() as writer:
+                for info in infos:
+                    writer.add_download_job(info, True)
+                writer.call(DB.finish_download_jobs, [(infos[0], True)])
+        self.assertEqual(1, mock_add.call_count)
+        self.assertEqual({'done': 1, 'in_progress': 2}, DB.count_download_jobs())
+
+    def test_call_when_writer_not_running(self):
+        writer = DB.QueueWriter()
+        with DB.Connect() as cursor:
+            DB.add_download_jobs(cursor, [{'id_': '1', 'media_url': 'u', 'is_nsfw': False,
+                                           'local_file_path': 'p.jpg'}])
+        writer.call(DB.finish_download_jobs, [({'id_': '1'}, False)])
+        self.assertEqual({'failed': 1}, DB.count_download_jobs())
+
+    @patch('taktyk.db.settings.DB_FLUSH_INTERVAL', 0.01)
+    def test_if_batch_committed_when_no_new_entries(self):
+        with DB.QueueWriter(batch_size=100) as writer:
+            writer.add(self.entry)
+            for _ in range(200):
+                if DB.get_ids('entry'):
+                    break
+                writer.thread.join(0.01)
+            self.assertEqual([1], DB.get_ids('entry'))
+
+    def test_if_error_in_writer_thread_raised(self):
+        def fail(cursor):
+            raise sqlite3.OperationalError('test')
+
+        with self.assertRaises(sqlite3.OperationalError):
+            with DB.QueueWriter(maxsize=1) as writer:
+                writer.call(fail)
+                for _ in range(10):  # queue is drained, so add() doesn't block
+                    writer.add(self.entry)
+
+
+class ConnectionTest(Prepare):
+    def setUp(self):
+        super().setUp()
+        DB.create_new('test')
+
+    def test_if_wal_and_pragmas_set(self):
+        with DB.Connect() as cursor:
+            self.assertEqual('wal', cursor.execute('PRAGMA journal_mode').fetchone()[0])
+            self.assertEqual(1, cursor.execute('PRAGMA synchronous').fetchone()[0])  # NORMAL
+            self.assertEqual(-settings.DB_CACHE_SIZE,
+                             cursor.execute('PRAGMA cache_size').fetchone()[0])
+
+    def test_if_connection_is_per_thread(self):
+        seen = []
+        with DB.Connect():
+            thread = threading.Thread(target=lambda: seen.append(DB.connection))
+            thread.start()
+            thread.join()
+            self.assertIsNotNone(DB.connection)
+        self.assertEqual([None], seen)
+        self.assertIsNone(DB.connection)
+
+    def test_if_outer_connection_restored_after_nested_block(self):
+        with DB.Connect() as cursor:
+            with DB.Connect():
+                pass
+            self.assertIs(cursor, DB.cursor)
+
+    def test_if_read_connection_is_query_only(self):
+        with DB.Read() as cursor:
+            with self.assertRaises(sqlite3.OperationalError):
+                cursor.execute('DELETE FROM entry')
+
+    def test_if_read_connections_reused_while_pool_active(self):
+        with DB.ReadPool():
+            with DB.Read() as cursor:
+                connection = cursor.connection
+            with DB.Read() as cursor:
+                self.assertIs(connection, cursor.connection)
+        with DB.Read() as cursor:
+            self.assertIsNot(connection, cursor.connection)
+
+    def test_if_readonly_function_sees_rows_committed_later(self):
+        with DB.ReadPool():
+            self.assertEqual([], DB.get_ids('entry'))
+            with DB.Connect() as cursor:
+                DB.insert_one(cursor, self.entry)
+            self.assertEqual([1], DB.get_ids('entry'))
+
+
 class GetIdsTest(Prepare):
     def setUp(self):
         super().setUp()
@@ -267,6 +492,31 @@ class GetAllEntriesWithCommentsTest(Prepare):
             result = list(DB.get_all_entries_with_comments(cursor, tag='testtag2'))
             self.assertEqual(1, len(result))
 
+    @patch('taktyk.db.DB.count_comments')
+    def test_if_comments_count_precomputed(self, mock_count_comments):
+        result = list(DB.get_all_entries_with_comments())  # called without cursor passed
+        self.assertEqual([3, 3], [entry.comments_count for entry in result])
+        self.assertFalse(mock_count_comments.called)
+
+    def test_if_entry_without_comments_returned(self):
+        with DB.Connect() as cursor:
+            self.entry.id_ = 3
+            self.entry.entry_id = None
+            self.entry.type_ = 'entry'
+            DB.insert_one(cursor, self.entry)
+            result = {entry.id_: entry for entry in DB.get_all_entries_with_comments(cursor)}
+        self.assertEqual(0, result[3].comments_count)
+        self.assertEqual([], result[3].comments)
+
+    def test_if_sorted_by_date_and_comments_grouped(self):
+        with DB.Connect() as cursor:
+            cursor.execute("UPDATE entry SET date = '2017-06-07' WHERE id = 1")
+            cursor.execute("UPDATE entry SET date = '2017-06-05' WHERE id = 2")
+            result = list(DB.get_all_entries_with_comments(cursor))
+        self.assertEqual([1, 2], [entry.id_ for entry in result])
+        self.assertEqual([5, 6, 7], [comment.id_ for comment in result[0].comments])
+        self.assertEqual([9, 10, 11], [comment.id_ for comment in result[1].comments])
+
 
 class CountTagsTest(Prepare):
     def setUp(self):
@@ -289,6 +539,10 @@ class CountTagsTest(Prepare):
         tags = DB.count_tags(arg_tag='differenttag')
         self.assertEqual(1, len(tags))
 
+    def test_if_tags_of_deleted_entry_not_counted(self):
+        DB.delete_entry(3)
+        self.assertEqual([('testtag1', 2)], DB.count_tags())
+
 
 class DeleteEntryTest(Prepare):
     def setUp(self):
@@ -328,6 +582,150 @@ class CountCommentsTest(Prepare):
     def test_if_correct_result(self):
         self.assertEqual(2, DB.count_comments(entry_id=1))
 
+    def test_count_comments_by_entry(self):
+        self.entry.id_ = 4
+        self.entry.entry_id = 5
+        with DB.Connect() as cursor:
+            DB.insert_one(cursor, self.entry)
+        self.assertEqual({1: 2, 5: 1}, DB.count_comments_by_entry())
+
+
+class UpdateRenderStateTest(Prepare):
+    def setUp(self):
+        super().setUp()
+        DB.create_new('test')
+        with DB.Connect() as cursor:
+            for id_ in range(1, 6):
+                self.entry.id_ = id_
+                self.entry.date = '2017-06-0{}'.format(6 - id_)  # 5 is the oldest
+                DB.insert_one(cursor, self.entry)
+
+    def get_pages(self):
+        return {page: count for page, count, _, _ in DB.get_render_pages('export')}
+
+    def test_first_export(self):
+        self.assertEqual(({1, 2, 3}, 3), DB.update_render_state('export', 2))
+        self.assertEqual({1: 2, 2: 2, 3: 1}, self.get_pages())
+        with DB.Connect() as cursor:
+            page = list(DB.get_all_entries_with_comments(cursor, page=('export', 1)))
+        self.assertEqual([4, 5], [entry.id_ for entry in page])
+
+    def test_when_nothing_changed(self):
+        DB.update_render_state('export', 2)
+        self.assertEqual((set(), 3), DB.update_render_state('export', 2))
+
+    def add_entries(self, ids, date):
+        self.entry.date = date
+        with DB.Connect() as cursor:
+            for id_ in ids:
+                self.entry.id_ = id_
+                DB.insert_one(cursor, self.entry)
+
+    def test_when_entries_added(self):
+        DB.update_render_state('export', 2)
+        self.add_entries((6, 7), '2017-06-07')
+        self.assertEqual(({3, 4}, 4), DB.update_render_state('export', 2))
+        self.assertEqual({1: 2, 2: 2, 3: 2, 4: 1}, self.get_pages())
+
+    def test_when_old_entry_added_check_if_placed_by_date(self):
+        DB.update_render_state('export', 2)
+        self.add_entries((6,), '2017-06-02 12:00:00')  # between entries of page 1 and 2
+        self.assertEqual(({2}, 3), DB.update_render_state('export', 2))
+        self.assertEqual({1: 2, 2: 3, 3: 1}, self.get_pages())
+        with DB.Connect() as cursor:
+            page = list(DB.get_all_entries_with_comments(cursor, page=('export', 2)))
+        self.assertEqual([2, 3, 6], sorted(entry.id_ for entry in page))
+
+    def test_when_page_grows_over_double_size_check_if_assigned_again(self):
+        DB.update_render_state('export', 2)
+        self.add_entries((6, 7, 8), '2017-06-01 12:00:00')
+        self.assertEqual(({1, 2, 3, 4}, 4), DB.update_render_state('export', 2))
+        self.assertEqual({1: 2, 2: 2, 3: 2, 4: 2}, self.get_pages())
+
+    def test_when_comment_added_and_entry_deleted(self):
+        DB.update_render_state('export', 2)
+        self.entry.id_ = 10
+        self.entry.entry_id = 5
+        self.entry.type_ = 'entry_comment'
+        with DB.Connect() as cursor:
+            DB.insert_one(cursor, self.entry)
+        DB.delete_entry(3)
+        self.assertEqual(({1, 2}, 3), DB.update_render_state('export', 2))
+
+    def test_when_all_entries_of_page_deleted_check_if_pages_moved_back(self):
+        DB.update_render_state('export', 2)
+        self.add_entries((6, 7), '2017-06-07')
+        DB.update_render_state('export', 2)  # pages: 1 - 5, 4; 2 - 3, 2; 3 - 1, 6; 4 - 7
+        for id_ in (3, 2):
+            DB.delete_entry(id_)
+        self.assertEqual(({2, 3}, 3), DB.update_render_state('export', 2))
+        self.assertEqual({1: 2, 2: 2, 3: 1}, self.get_pages())
+        with DB.Connect() as cursor:
+            page = list(DB.get_all_entries_with_comments(cursor, page=('export', 3)))
+        self.assertEqual([7], [entry.id_ for entry in page])
+
+    def test_when_page_size_changed_or_reset(self):
+        DB.update_render_state('export', 2)
+        self.assertEqual(({1, 2}, 2), DB.update_render_state('export', 3))
+        self.assertEqual(({1, 2}, 2), DB.update_render_state('export', 3, reset=True))
+
+
+class DownloadJobsTest(Prepare):
+    def setUp(self):
+        super().setUp()
+        patcher = patch('taktyk.db.settings.NSFW_FILTER', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        DB.create_new('test')
+        self.infos = [{'id_': '1', 'media_url': 'u1.jpg', 'is_nsfw': False,
+                       'local_file_path': '1.jpg'},
+                      {'id_': '1_2', 'media_url': 'u2.jpg', 'is_nsfw': True,
+                       'local_file_path': '1_2.jpg'}]
+        with DB.Connect() as cursor:
+            DB.add_download_jobs(cursor, self.infos)
+
+    def test_if_pending_jobs_returned(self):
+        self.assertEqual(self.infos, DB.get_download_jobs())
+        self.assertEqual(self.infos[:1], DB.get_download_jobs(skip_comments=True))
+        self.assertEqual({'pending': 2}, DB.count_download_jobs())
+
+    def test_if_done_jobs_not_returned(self):
+        with DB.Connect() as cursor:
+            DB.add_download_jobs(cursor, self.infos, in_progress=True)
+        self.assertEqual({'in_progress': 2}, DB.count_download_jobs())
+        DB.finish_download_jobs([(self.infos[0], True), (self.infos[1], False)])
+        self.assertEqual({'done': 1, 'failed': 1}, DB.count_download_jobs())
+        self.assertEqual(self.infos[1:], DB.get_download_jobs())
+
+    def test_if_skipped_jobs_not_returned(self):
+        DB.finish_download_jobs([(self.infos[1], None)])
+        self.assertEqual({'pending': 1, 'skipped': 1}, DB.count_download_jobs())
+        self.assertEqual(self.infos[:1], DB.get_download_jobs())
+
+    @patch('taktyk.db.settings.DOWNLOAD_MAX_ATTEMPTS', 2)
+    def test_if_failed_job_retried_until_max_attempts(self):
+        for _ in range(2):
+            self.assertIn(self.infos[1], DB.get_download_jobs())
+            DB.finish_download_jobs([(self.infos[1], False)])
+        self.assertNotIn(self.infos[1], DB.get_download_jobs())
+
+    def test_if_nsfw_jobs_left_pending_when_nsfw_filter_on(self):
+        with patch('taktyk.db.settings.NSFW_FILTER', True):
+            self.assertEqual(self.infos[:1], DB.get_download_jobs())
+        self.assertEqual(self.infos, DB.get_download_jobs())
+
+    def test_if_jobs_of_deleted_entry_removed(self):
+        with DB.Connect() as cursor:
+            DB.add_download_jobs(cursor, [dict(self.infos[0], id_='11'),
+                                          dict(self.infos[0], id_='11_3')])
+        DB.delete_entry(1)
+        self.assertEqual(['11', '11_3'], sorted(info['id_'] for info in DB.get_download_jobs()))
+
+    def test_if_recorded_job_not_duplicated(self):
+        with DB.Connect() as cursor:
+            DB.add_download_jobs(cursor, self.infos)
+        self.assertEqual(2, len(DB.get_download_jobs()))
+
 
 class DatabaseListTest(Prepare):
     def test_if_result_correct(self):
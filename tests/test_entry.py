@@ -1,4 +1,5 @@
 import os
+import pickle
 import sys
 import unittest
 from unittest.mock import patch
@@ -21,6 +22,29 @@ class EntryTest(unittest.TestCase):
         self.assertEqual(tuple(self.entry.attrs_gen()), args[:11])
         self.assertEqual(tuple(self.entry.__iter__()), args[:11])
 
+    def test_values_in_columns_order(self):
+        self.assertEqual(tuple(getattr(self.entry, c) for c in Entry.COLUMNS), self.entry.values())
+        self.assertEqual(11, len(self.entry.values()))
+
+    def test_no_instance_dict(self):
+        self.assertFalse(hasattr(self.entry, '__dict__'))
+        with self.assertRaises(AttributeError):
+            self.entry.not_a_field = 1
+
+    def test_pickle(self):
+        self.entry.media_url = 'url/file.jpg'
+        self.entry.local_file_path  # computing cache before pickling
+        entry = pickle.loads(pickle.dumps(self.entry))
+        self.assertEqual(self.entry.values(), entry.values())
+        self.assertEqual(self.entry.local_file_path, entry.local_file_path)
+
+    def test_media_cache_recomputed_when_media_url_changed(self):
+        self.entry.media_url = 'url/file.jpg'
+        self.assertEqual('.jpg', self.entry.media_ext)
+        self.entry.media_url = 'url/file.png'
+        self.assertEqual('.png', self.entry.media_ext)
+        self.assertTrue(self.entry.local_file_path.endswith('.png'))
+
     def test_str(self):
         self.assertEqual('entry_id_123', str(self.entry))
         self.entry.entry_id = None
@@ -40,6 +64,13 @@ class EntryTest(unittest.TestCase):
         mock_comments_count.return_value = 125
         self.assertEqual(125, self.entry.comments_count)
 
+    @patch('taktyk.db.DB.count_comments')
+    def test_comments_count_when_precomputed(self, mock_comments_count):
+        self.entry.entry_id = None
+        self.entry.comments_count = 7
+        self.assertEqual(7, self.entry.comments_count)
+        self.assertFalse(mock_comments_count.called)
+
     def test_media_ext_when_media_url_is_none(self):
         self.entry.media_url = ''
         self.assertIsNone(self.entry.media_ext)
@@ -1,12 +1,13 @@
 import os
 import sys
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(os.path.abspath(__file__)))))
 
 from taktyk.entry import Entry
 from taktyk.entrygenerators import APIMethod, ScrapeMethod
+from taktyk.parsers import HtmlParser
 
 
 class ApiMethodTest(unittest.TestCase):
@@ -219,3 +220,95 @@ class ScrapeMethodGenOneEntryTest(unittest.TestCase):
         self.parser.get_comments_generator = Mock(return_value=['comment', 'comment', 'comment'])
         next(self.scrape.gen_one_entry('123', 'html'))
         self.parser.get_comments_generator.assert_called_with(4)
+
+
+class AddKnownTest(unittest.TestCase):
+    def setUp(self):
+        self.api = APIMethod(db_handler=Mock())
+        self.api.db_ids = {1}
+        self.api.comments_counts = {1: 2}
+
+    def test_when_entry_added(self):
+        self.api.add_known(Entry(id_=5, type_='entry'))
+        self.assertEqual({1, 5}, self.api.db_ids)
+        self.assertEqual({1: 2}, self.api.comments_counts)
+
+    def test_when_comments_added(self):
+        self.api.add_known(Entry(id_=10, entry_id=1, type_='entry_comment'))
+        self.api.add_known(Entry(id_=11, entry_id='5', type_='entry_comment'))
+        self.assertEqual({1: 3, 5: 1}, self.api.comments_counts)
+        self.assertEqual({1}, self.api.db_ids)
+
+    def test_when_comments_counts_not_loaded(self):
+        self.api.comments_counts = None
+        self.api.add_known(Entry(id_=10, entry_id=1, type_='entry_comment'))
+        self.assertIsNone(self.api.comments_counts)
+
+    def test_if_entry_repeated_in_run_is_skipped(self):
+        scrape = ScrapeMethod(db_handler=Mock())
+        scrape.db_ids = set()
+        scrape.full_update = False
+        self.assertEqual(0, scrape.get_start_index('7'))
+        scrape.add_known(Entry(id_=7, type_='entry'))
+        self.assertIsNone(scrape.get_start_index('7'))
+
+    def test_if_same_id_twice_in_one_run_is_generated_once(self):
+        api = APIMethod(db_handler=Mock())
+        api.db_ids = set()
+        api.full_update = False
+        json_ = {'id': 7, 'type': 'entry', 'author': 'user', 'date': '2018-05-05 21:36:47',
+                 'vote_count': 1, 'body': 'text', 'comments': []}
+        ids = []
+        for entry in api.generate_all([[json_], [json_, dict(json_, id=8)]]):
+            api.add_known(entry)
+            ids.append(entry.id_)
+        self.assertEqual([7, 8], ids)
+
+
+class ScrapeMethodGenerateAllTest(unittest.TestCase):
+    soup_f = '''<div class="wblock lcontrast dC" data-id="{id_}">
+        <a class="showProfileSummary"><b>user</b></a><time title="2018-05-05 21:36:47"></time>
+        <p class="vC" data-vc="1"></p><div class="text"><p>text {id_}</p></div></div>'''
+
+    def setUp(self):
+        self.scrape = ScrapeMethod(HtmlParser, Mock())
+        self.scrape.db_ids = []
+        self.raw_sources = [(str(id_), self.get_html(id_, [id_ * 10, id_ * 10 + 1]))
+                            for id_ in range(1, 6)]
+
+    def get_html(self, id_, comments_ids):
+        soups = [self.soup_f.format(id_=id_)] + [self.soup_f.format(id_=c) for c in comments_ids]
+        return '<html><body><li class="entry">{}</li></body></html>'.format(''.join(soups))
+
+    def get_ids(self, processes):
+        with patch('taktyk.entrygenerators.settings.PARSE_PROCESSES', processes):
+            return [entry.id_ for entry in self.scrape.generate_all(self.raw_sources)]
+
+    def test_if_process_pool_output_equals_main_process_output(self):
+        expected = [id_ for i in range(1, 6) for id_ in (i, i * 10, i * 10 + 1)]
+        self.assertEqual(expected, self.get_ids(1))
+        self.assertEqual(expected, self.get_ids(2))
+
+    def test_when_in_db_ids_and_full_update(self):
+        self.scrape.db_ids = [1, 2]
+        self.scrape.full_update = True
+        self.scrape.db_handler.count_comments.side_effect = lambda id_: 1 if id_ == '1' else 2
+        self.assertEqual([11] + [id_ for i in range(3, 6) for id_ in (i, i * 10, i * 10 + 1)],
+                         self.get_ids(2))
+
+    def test_when_in_db_ids_and_full_update_with_preloaded_comments_counts(self):
+        self.scrape.db_ids = [1, 2]
+        self.scrape.full_update = True
+        self.scrape.comments_counts = {1: 1, 2: 2}
+        self.assertEqual([11] + [id_ for i in range(3, 6) for id_ in (i, i * 10, i * 10 + 1)],
+                         self.get_ids(1))
+        self.assertFalse(self.scrape.db_handler.count_comments.called)
+
+    def test_count_comments_when_entry_not_in_comments_counts(self):
+        self.scrape.comments_counts = {}
+        self.assertEqual(0, self.scrape.count_comments('7'))
+
+    def test_when_in_db_ids_and_not_full_update(self):
+        self.scrape.db_ids = [1, 2, 3, 4]
+        self.scrape.full_update = False
+        self.assertEqual([5, 50, 51], self.get_ids(2))
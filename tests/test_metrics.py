@@ -0,0 +1,100 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(os.path.abspath(__file__)))))
+
+from taktyk.metrics import Metrics, call_with_metrics, metrics
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_add(self):
+        self.metrics.add('download', seconds=0.5, bytes_=100)
+        self.metrics.add('download', 2, 1.5, 300)
+        self.assertEqual({'count': 3, 'seconds': 2.0, 'bytes': 400},
+                         self.metrics.snapshot()['stages']['download'])
+
+    def test_timer(self):
+        with self.metrics.timer('parse', 4):
+            pass
+        stage = self.metrics.snapshot()['stages']['parse']
+        self.assertEqual(4, stage['count'])
+        self.assertGreaterEqual(stage['seconds'], 0)
+
+    def test_timer_when_exception(self):
+        with self.assertRaises(ValueError):
+            with self.metrics.timer('parse'):
+                raise ValueError
+        self.assertEqual(1, self.metrics.snapshot()['stages']['parse']['count'])
+
+    def test_gauge(self):
+        for value in (3, 10, 2):
+            self.metrics.gauge('download_queue', value)
+        self.assertEqual({'current': 2, 'max': 10}, self.metrics.snapshot()['gauges']['download_queue'])
+
+    def test_merge(self):
+        other = Metrics()
+        other.add('parse', 5, 1.0)
+        other.gauge('queue', 8)
+        other.gauge('queue', 1)
+        self.metrics.add('parse', 1, 1.0)
+        self.metrics.merge(other.snapshot())
+        snapshot = self.metrics.snapshot()
+        self.assertEqual({'count': 6, 'seconds': 2.0, 'bytes': 0}, snapshot['stages']['parse'])
+        self.assertEqual({'current': 1, 'max': 8}, snapshot['gauges']['queue'])
+
+    def test_report(self):
+        self.metrics.add('db_insert', 4, 2.0)
+        self.metrics.add('empty', 0)
+        report = self.metrics.report()
+        self.assertEqual(500, report['stages']['db_insert']['avg_ms'])
+        self.assertGreater(report['stages']['db_insert']['per_second'], 0)
+        self.assertEqual(0, report['stages']['empty']['avg_ms'])
+
+    def test_format_line(self):
+        self.metrics.add('download', bytes_=1048576)
+        self.metrics.add('parse')
+        self.metrics.gauge('download_queue', 7)
+        line = self.metrics.format_line()
+        self.assertRegex(line, r'^download [\d.]+/s [\d.]+ MB/s \| parse [\d.]+/s \| download_queue 7$')
+
+    def test_live_line(self):
+        self.assertIsNotNone(self.metrics.live_line(interval=10))
+        self.assertIsNone(self.metrics.live_line(interval=10))
+        self.assertIsNotNone(self.metrics.live_line(interval=0))
+
+    def test_dump(self):
+        self.metrics.add('parse', 2, 0.1)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'metryki.json')
+            self.metrics.dump(path)
+            with open(path) as file:
+                report = json.load(file)
+        self.assertEqual(2, report['stages']['parse']['count'])
+        self.assertIn('elapsed', report)
+
+
+class CallWithMetricsTest(unittest.TestCase):
+    def tearDown(self):
+        metrics.reset()
+
+    def test_call_with_metrics(self):
+        metrics.add('before')
+
+        def func(value):
+            metrics.add('parse', value)
+            return value * 2
+
+        result, snapshot = call_with_metrics(func, 3)
+        self.assertEqual(6, result)
+        self.assertEqual(['parse'], list(snapshot['stages']))
+        self.assertEqual(3, snapshot['stages']['parse']['count'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,12 @@
 import os
 import sys
 import unittest
+from unittest.mock import Mock, patch
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(os.path.abspath(__file__)))))
 
-from taktyk.parsers import JsonParser, HtmlParser
+from taktyk import settings
+from taktyk.parsers import JsonParser, HtmlParser, BODY_PARSERS, get_bs4_features
 
 
 class JsonParserInitTest(unittest.TestCase):
@@ -81,6 +83,25 @@ class JsonParserParseBodyAndTagsTest(unittest.TestCase):
         self.assertTrue('https://www.wykop.pl/tag/python' in js.entry.body_html)
         self.assertTrue('https://www.wykop.pl/ludzie/test_user' in js.entry.body_html)
 
+    def test_href_replacements_when_tag_is_prefix_of_another_tag(self):
+        body = '#<a href="#foobar">foobar</a> #<a href="#foo">foo</a> @<a href="@foo">foo</a>'
+        js = JsonParser({'body': body})
+        js._parse_body_and_tags()
+        self.assertEqual('#<a href="https://www.wykop.pl/tag/foobar">foobar</a> '
+                         '#<a href="https://www.wykop.pl/tag/foo">foo</a> '
+                         '@<a href="https://www.wykop.pl/ludzie/foo">foo</a>', js.entry.body_html)
+        self.assertEqual(' foobar foo ', js.entry.tags)
+
+    def test_href_replacements_only_in_href_values(self):
+        body = ('#foo in text <a href="https://example.com/page#foo">link</a> '
+                "#<a href='#foo'>foo</a> mail@foo")
+        js = JsonParser({'body': body})
+        js._parse_body_and_tags()
+        self.assertEqual('#foo in text <a href="https://example.com/page#foo">link</a> '
+                         "#<a href='https://www.wykop.pl/tag/foo'>foo</a> mail@foo",
+                         js.entry.body_html)
+        self.assertEqual(' foo ', js.entry.tags)
+
     def test_if_body_parsed_correctly(self):
         json_ = {'body': self.body}
         js = JsonParser(json_)
@@ -88,6 +109,38 @@ class JsonParserParseBodyAndTagsTest(unittest.TestCase):
         self.assertEqual('#programowanie test text @test_user #python', js.entry.body)
 
 
+class BodyParsersTest(unittest.TestCase):
+    bodies = [
+        '#<a href="#programowanie">programowanie</a> @<a href="@test_user">test_user</a>',
+        'a &amp; b &lt;3 &#39;c&#x27; &nbsp;d <br /> <br> <a>no href</a> <!-- comment -->',
+        '<p>unclosed <b>bold <i>italic</p> tail <a href="https://www.wykop.pl" href="#x">x</a>',
+        '<code>&lt;a href="#python"&gt;</code> <![CDATA[cdata]]> ' + '<a href="#t">t</a>' * 50,
+        '',
+    ]
+
+    def test_if_backends_return_same_hrefs_and_text(self):
+        for body in self.bodies:
+            with self.subTest(body=body):
+                self.assertEqual(BODY_PARSERS['bs4'](body), BODY_PARSERS['tokenizer'](body))
+
+    def test_if_json_parser_entry_same_for_every_backend(self):
+        json_ = {'body': JsonParserParseBodyAndTagsTest.body}
+        entries = []
+        for name in BODY_PARSERS:
+            with patch('taktyk.parsers.settings.BODY_PARSER', name):
+                js = JsonParser(dict(json_))
+                js._parse_body_and_tags()
+                entries.append((js.entry.body, js.entry.body_html, js.entry.tags))
+        self.assertEqual(1, len(set(entries)))
+
+    def test_get_bs4_features(self):
+        with patch('taktyk.parsers.settings.HTML_PARSER', 'html5lib'):
+            self.assertEqual('html5lib', get_bs4_features())
+        with patch('taktyk.parsers.settings.HTML_PARSER', None):
+            self.assertEqual('html.parser', get_bs4_features())
+        self.assertEqual('html.parser', settings.HTML_PARSER)  # lxml only when chosen
+
+
 class JsonParserParseNsfwTest(unittest.TestCase):
     def test_when_embed(self):
         json_ = {'embed': {'plus18': True}}
@@ -195,6 +248,12 @@ class HtmlParserTest(unittest.TestCase):
         self.assertEqual('entry', entry.type_)
         self.assertIsNone(entry.entry_id)
 
+    def test_get_main_entry_parses_once(self):
+        helper = Mock()
+        HtmlParser('1', self.entry, helper=helper).get_main_entry()
+        helper.assert_called_once_with('1', helper.call_args[0][1])
+        helper.return_value.parse.assert_called_once_with()
+
     def test_get_comments_generator(self):
         comments = list(HtmlParser('1', self.entry).get_comments_generator(start_index=1))
         authors = ['test_user_com1', 'test_user_com2']
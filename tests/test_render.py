@@ -1,4 +1,5 @@
 import os
+import shutil
 import sys
 import unittest
 from contextlib import ContextDecorator
@@ -68,6 +69,8 @@ class HtmlFileTest(unittest.TestCase):
             def __exit__(self, exc_type, exc_val, exc_tb):
                 pass
 
+        connect = DB.Connect
+        self.addCleanup(setattr, DB, 'Connect', connect)
         DB.Connect = MockConnect
         htmlfile = HtmlFile()
         htmlfile.user_files_path = os.path.join(settings.SAVE_PATH, 'tests')
@@ -82,3 +85,133 @@ class HtmlFileTest(unittest.TestCase):
             self.assertTrue(tag in content)
         for arg in entry_args:
             self.assertTrue(arg in content)
+
+    @patch('time.strftime')
+    def test_save_stream_if_same_output_as_render(self, test_strftime):
+        test_strftime.return_value = self.date
+        tags = [('testtag1', 2)]
+        entry = Entry('444', 'testauthor', 'testdate', '', 'zażółć', 'testurl', '+1000', '',
+                      ' testtag1 ', '')
+        entry.comments = []
+        entry.comments_count = 0
+        htmlfile = HtmlFile()
+        htmlfile.user_files_path = os.path.join(settings.SAVE_PATH, 'tests')
+        htmlfile.save_stream(tags, [entry])
+
+        with open(self.html_path, 'rb') as file:
+            content = file.read()
+        self.assertEqual(htmlfile.render(tags, [entry]), content)
+
+    def test_save_stream_when_no_template(self):
+        htmlfile = HtmlFile()
+        htmlfile.templates_path = ''
+        htmlfile.template_name = 'templatenotfound.html'
+        htmlfile.get_full_path = Mock()
+        with self.assertRaises(SystemExit):
+            htmlfile.save_stream([], [])
+        self.assertFalse(htmlfile.get_full_path.called)
+
+
+class HtmlPagesTest(unittest.TestCase):
+    def setUp(self):
+        self.user_files_path = settings.USER_FILES_PATH
+        settings.USER_FILES_PATH = os.path.join(settings.SAVE_PATH, 'tests', 'pages')
+        os.makedirs(os.path.join(settings.USER_FILES_PATH, settings.DB_DIR_NAME), exist_ok=True)
+        DB.create_new('test')
+        with DB.Connect() as cursor:
+            for id_, tags in ((1, ' tag1 '), (2, ' tag1 tag2 '), (3, ' tag3 ')):
+                entry = Entry(id_, 'author', '2017-06-0{}'.format(id_), 'body', 'body_html', 'url',
+                              '1', '', tags, False, None, 'entry')
+                DB.insert_one(cursor, entry)
+            DB.insert_one(cursor, Entry(11, 'author', 'date', 'body', 'comment_html', 'url', '1',
+                                        '', ' # ', False, 3, 'entry_comment'))
+
+    def tearDown(self):
+        shutil.rmtree(settings.USER_FILES_PATH)
+        settings.USER_FILES_PATH = self.user_files_path
+        settings.HTML_PROCESSES = None
+
+    def read(self, file_name):
+        with open(os.path.join(settings.USER_FILES_PATH, file_name), encoding='utf-8') as file:
+            return file.read()
+
+    def test_create_pages(self):
+        settings.HTML_PROCESSES = 1
+        htmlfile = HtmlFile(page_size=2)
+        htmlfile.create()
+        self.assertEqual('taktyk-strona-index.html', htmlfile.file_name)
+
+        page_1 = self.read('taktyk-strona-1.html')
+        page_2 = self.read('taktyk-strona-2.html')
+        self.assertIn('id="e1"', page_1)
+        self.assertIn('id="e2"', page_1)
+        self.assertNotIn('id="e3"', page_1)
+        self.assertIn('id="e3"', page_2)
+        self.assertIn('comment_html', page_2)
+        self.assertIn('<option value="tag3">tag3 (1)</option>', page_2)
+        self.assertNotIn('tag3', page_1)
+        self.assertIn('href="taktyk-strona-2.html"', page_1)
+        self.assertIn('href="taktyk-strona-1.html"', page_2)
+
+        index = self.read(htmlfile.file_name)
+        self.assertIn('taktyk-strona-1.html', index)
+        self.assertIn('taktyk-strona-2.html', index)
+        self.assertIn('tag1 (2)', index)
+
+    def test_create_pages_in_worker_processes(self):
+        settings.HTML_PROCESSES = 2
+        HtmlFile(page_size=1).create()
+        for page in (1, 2, 3):
+            self.assertIn('id="e{}"'.format(page), self.read('taktyk-strona-{}.html'.format(page)))
+
+    def test_if_stale_pages_removed(self):
+        settings.HTML_PROCESSES = 1
+        HtmlFile(page_size=1).create()
+        HtmlFile(page_size=2).create()
+        self.assertFalse(os.path.isfile(os.path.join(settings.USER_FILES_PATH,
+                                                     'taktyk-strona-3.html')))
+
+    def test_create_pages_with_tag(self):
+        settings.HTML_PROCESSES = 1
+        htmlfile = HtmlFile(tag='tag1', page_size=5)
+        htmlfile.create()
+        page = self.read('taktyk-tag1-strona-1.html')
+        self.assertIn('id="e1"', page)
+        self.assertNotIn('id="e3"', page)
+        self.assertEqual('taktyk-tag1-strona-index.html', htmlfile.file_name)
+
+    def mark_page(self, page):
+        with open(os.path.join(settings.USER_FILES_PATH, 'taktyk-strona-{}.html'.format(page)),
+                  'w') as file:
+            file.write('not rendered again')
+
+    def test_incremental_renders_only_page_with_new_entry(self):
+        settings.HTML_PROCESSES = 1
+        HtmlFile(page_size=2, incremental=True).create()
+        self.mark_page(1)
+        self.mark_page(2)
+        with DB.Connect() as cursor:
+            DB.insert_one(cursor, Entry(4, 'author', '2017-06-04', 'body', 'body_html', 'url', '1',
+                                        '', ' # ', False, None, 'entry'))
+        HtmlFile(page_size=2, incremental=True).create()
+        self.assertEqual('not rendered again', self.read('taktyk-strona-1.html'))
+        self.assertIn('id="e4"', self.read('taktyk-strona-2.html'))
+
+    def test_incremental_renders_page_with_new_comment(self):
+        settings.HTML_PROCESSES = 1
+        HtmlFile(page_size=2, incremental=True).create()
+        self.mark_page(1)
+        self.mark_page(2)
+        with DB.Connect() as cursor:
+            DB.insert_one(cursor, Entry(12, 'author', 'date', 'body', 'new_comment_html', 'url',
+                                        '1', '', ' # ', False, 1, 'entry_comment'))
+        HtmlFile(page_size=2, incremental=True).create()
+        self.assertIn('new_comment_html', self.read('taktyk-strona-1.html'))
+        self.assertEqual('not rendered again', self.read('taktyk-strona-2.html'))
+
+    def test_not_incremental_renders_all_pages(self):
+        settings.HTML_PROCESSES = 1
+        HtmlFile(page_size=2, incremental=True).create()
+        self.mark_page(1)
+        HtmlFile(page_size=2).create()
+        self.assertIn('id="e1"', self.read('taktyk-strona-1.html'))
@@ -7,13 +7,41 @@ import requests
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(os.path.abspath(__file__)))))
 
-from taktyk.request import Request
+from taktyk import settings
+from taktyk.request import EmptyListError, Request
+
+
+class RequestSessionTest(unittest.TestCase):
+    def setUp(self):
+        Request._session = None
+
+    def test_if_session_created_once(self):
+        self.assertIs(Request.get_session(), Request.get_session())
+
+    def test_if_session_recreated_in_new_process(self):
+        session = Request.get_session()
+        Request._session_pid = -1
+        self.assertIsNot(session, Request.get_session())
+
+    def test_if_pool_size_fits_concurrent_requests(self):
+        self.assertGreaterEqual(Request.get_pool_size(), settings.API_PAGES_WINDOW)
+        self.assertGreaterEqual(Request.get_pool_size(), settings.DOWNLOAD_PER_HOST)
+        with patch('taktyk.request.settings.REQUEST_POOL_SIZE', 40):
+            self.assertEqual(40, Request.get_pool_size())
+
+    def test_if_adapter_has_pool_and_retries(self):
+        adapter = Request.get_session().get_adapter('https://www.wykop.pl')
+        self.assertEqual(Request.get_pool_size(), adapter._pool_maxsize)
+        self.assertEqual(settings.REQUEST_RETRIES, adapter.max_retries.total)
+        self.assertIn(429, adapter.max_retries.status_forcelist)
 
 
 class RequestGetTest(unittest.TestCase):
     def setUp(self):
-        patcher = patch('requests.get')
-        self.mock_requests_get = patcher.start()
+        mock_session = Mock()
+        self.mock_requests_get = mock_session.get
+        patcher = patch('taktyk.request.Request.get_session', return_value=mock_session)
+        patcher.start()
         self.addCleanup(patcher.stop)
 
     def test_if_kwargs_are_passed_to_requests_get(self):
@@ -83,6 +111,7 @@ class RequestGetJsonTest(unittest.TestCase):
             Request.get_json('')
         ex_msg = str(ex.exception)
         self.assertEqual(ex_msg, 'Empty list')
+        self.assertIsInstance(ex.exception, EmptyListError)
 
     def test_when_response_ok_and_json_ok(self):
         mock_response = Mock()
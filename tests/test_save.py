@@ -1,12 +1,16 @@
 import os
+import shutil
 import sys
+import tempfile
+import threading
+import time
 import unittest
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(os.path.abspath(__file__)))))
 
 from taktyk import settings
-from taktyk.save import Save
+from taktyk.save import Multi, Save, get_validator, host_limit
 
 
 class SaveTest(unittest.TestCase):
@@ -83,8 +87,15 @@ class SaveTest(unittest.TestCase):
 
     def test_save_when_no_url(self):
         self.save.url = None
+        self.save._ext = None
         self.assertIsNone(self.save.save())
 
+    @patch('taktyk.save.Save.save_to_text_file')
+    @patch('taktyk.save.Request.get_json', side_effect=ValueError)
+    def test_save_when_gfycat_request_failed(self, *_):
+        save = Save(1, 'https://gfycat.com/a', False, '1.webm', exts=['.webm'], cwd='test')
+        self.assertIs(False, save.save())
+
     def test_save_when_nsfw_inconsistent(self):
         self.save.nsfw_consistent = False
         self.assertIsNone(self.save.save())
@@ -111,3 +122,225 @@ class SaveTest(unittest.TestCase):
         self.save.url = 'url'
         self.save.nsfw_consistent = True
         self.assertFalse(self.save.save())
+
+
+class SaveSingleFileTest(unittest.TestCase):
+    content = b'0123456789' * 10
+
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir_path)
+        self.full_path = os.path.join(self.dir_path, '1.jpg')
+        self.part_path = self.full_path + settings.DOWNLOAD_PART_EXT
+        patcher = patch('taktyk.save.Request.get', side_effect=self.get)
+        self.mock_get = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.fail_after = None
+        self.range_supported = True
+        self.etag = '"v1"'
+
+    def get(self, url, headers=None, **kwargs):
+        start = 0
+        if headers and self.range_supported and headers['If-Range'] == self.etag:
+            start = int(headers['Range'][6:-1])
+        body = self.content[start:]
+
+        def iter_content(chunk_size):
+            for index in range(0, len(body), chunk_size):
+                if self.fail_after is not None and start + index >= self.fail_after:
+                    raise ConnectionError('connection lost')
+                yield body[index:index + chunk_size]
+        return Mock(status_code=206 if start else 200, iter_content=iter_content,
+                    headers={'Content-Length': str(len(body)), 'ETag': self.etag})
+
+    def read(self, path):
+        with open(path, 'rb') as file:
+            return file.read()
+
+    @patch('taktyk.save.settings.DOWNLOAD_CHUNK_SIZE', 10)
+    def test_if_interrupted_download_leaves_only_part_file(self):
+        self.fail_after = 30
+        self.assertFalse(Save.save_single_file('url', self.full_path))
+        self.assertFalse(os.path.exists(self.full_path))
+        self.assertEqual(self.content[:30], self.read(self.part_path))
+
+    @patch('taktyk.save.settings.DOWNLOAD_CHUNK_SIZE', 10)
+    def test_if_download_resumed_with_range(self):
+        self.fail_after = 30
+        Save.save_single_file('url', self.full_path)
+        self.fail_after = None
+        self.assertTrue(Save.save_single_file('url', self.full_path))
+        self.assertEqual({'Range': 'bytes=30-', 'If-Range': '"v1"'},
+                         self.mock_get.call_args[1]['headers'])
+        self.assertEqual(self.content, self.read(self.full_path))
+        self.assertEqual([self.full_path], [os.path.join(self.dir_path, name)
+                                            for name in os.listdir(self.dir_path)])
+
+    @patch('taktyk.save.settings.DOWNLOAD_CHUNK_SIZE', 10)
+    def test_when_range_not_supported_download_starts_over(self):
+        self.fail_after = 30
+        Save.save_single_file('url', self.full_path)
+        self.fail_after = None
+        self.range_supported = False
+        self.assertTrue(Save.save_single_file('url', self.full_path))
+        self.assertEqual(self.content, self.read(self.full_path))
+        self.assertEqual(2, self.mock_get.call_count)  # full response to range request is used
+
+    @patch('taktyk.save.settings.DOWNLOAD_CHUNK_SIZE', 10)
+    def test_when_remote_file_changed_download_starts_over(self):
+        self.fail_after = 30
+        Save.save_single_file('url', self.full_path)
+        self.fail_after = None
+        self.content = b'abcdefghij' * 10
+        self.etag = '"v2"'
+        self.assertTrue(Save.save_single_file('url', self.full_path))
+        self.assertEqual(self.content, self.read(self.full_path))
+
+    def test_when_part_file_without_validator_range_not_requested(self):
+        with open(self.part_path, 'wb') as file:
+            file.write(b'garbage')
+        self.assertTrue(Save.save_single_file('url', self.full_path))
+        self.assertNotIn('headers', self.mock_get.call_args[1])
+        self.assertEqual(self.content, self.read(self.full_path))
+
+    def test_get_validator(self):
+        self.assertEqual('"a"', get_validator(Mock(headers={'ETag': '"a"'})))
+        self.assertEqual('date', get_validator(Mock(headers={'ETag': 'W/"a"',
+                                                             'Last-Modified': 'date'})))
+        self.assertIsNone(get_validator(Mock(headers={})))
+
+    def test_when_host_unreachable_check_if_skipped(self):
+        self.assertTrue(Save.save_single_file('url', self.full_path))
+        self.assertTrue(self.mock_get.call_args[1]['skip'])
+
+    def test_when_request_failed(self):
+        self.mock_get.side_effect = None
+        self.mock_get.return_value = None
+        self.assertFalse(Save.save_single_file('url', self.full_path))
+        self.assertFalse(os.path.exists(self.part_path))
+
+
+class MediaStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cwd)
+        os.makedirs(os.path.join(self.cwd, settings.FILES_DIR_NAME))
+        patcher = patch('taktyk.save.Save.save_single_file', side_effect=self.download)
+        self.mock_download = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.contents = {}
+
+    def download(self, url, full_path, msg=''):
+        with open(full_path, 'wb') as file:
+            file.write(self.contents.get(url, url.encode('utf-8')))
+        return True
+
+    def save(self, id_, media_url):
+        local_file_path = os.path.join(settings.FILES_DIR_NAME, '{}.jpg'.format(id_))
+        saved = Save(id_, media_url, False, local_file_path, exts=['.jpg', '.webm'],
+                     cwd=self.cwd).save()
+        return saved, os.path.join(self.cwd, local_file_path)
+
+    def test_if_same_url_not_downloaded_again(self):
+        _, path1 = self.save(1, 'http://url.com/a.jpg')
+        saved, path2 = self.save(2, 'http://url.com/a.jpg')
+        self.assertTrue(saved)
+        self.assertEqual(1, self.mock_download.call_count)
+        self.assertTrue(os.path.samefile(path1, path2))
+
+    def test_if_same_content_from_other_url_stored_once(self):
+        self.contents = {'http://url.com/a.jpg': b'image', 'http://other.com/b.jpg': b'image'}
+        _, path1 = self.save(1, 'http://url.com/a.jpg')
+        _, path2 = self.save(2, 'http://other.com/b.jpg')
+        self.assertEqual(2, self.mock_download.call_count)
+        self.assertTrue(os.path.samefile(path1, path2))
+        content_dir = os.path.join(self.cwd, settings.FILES_DIR_NAME,
+                                   settings.MEDIA_STORE_DIR_NAME, 'content')
+        self.assertEqual(1, len(os.listdir(content_dir)))
+
+    @patch('taktyk.save.Save.get_gfycat_url', return_value='http://giant.gfycat.com/a.webm')
+    def test_if_gfycat_url_not_resolved_when_stored(self, mock_get_gfycat_url):
+        local_file_path = os.path.join(settings.FILES_DIR_NAME, '{}.webm')
+        for id_ in (1, 2):
+            Save(id_, 'https://gfycat.com/a', False, local_file_path.format(id_),
+                 exts=['.webm'], cwd=self.cwd).save()
+        self.assertEqual(1, mock_get_gfycat_url.call_count)
+        self.assertEqual(1, self.mock_download.call_count)
+
+    @patch('taktyk.save.os.link', side_effect=OSError)
+    def test_when_hardlinks_not_supported(self, _):
+        _, path1 = self.save(1, 'http://url.com/a.jpg')
+        saved, path2 = self.save(2, 'http://url.com/a.jpg')
+        self.assertTrue(saved)
+        self.assertEqual(1, self.mock_download.call_count)
+        with open(path2, 'rb') as file:
+            self.assertEqual(b'http://url.com/a.jpg', file.read())
+        store_path = os.path.join(self.cwd, settings.FILES_DIR_NAME, settings.MEDIA_STORE_DIR_NAME)
+        self.assertEqual([], os.listdir(os.path.join(store_path, 'content')))
+        url_index = os.path.join(store_path, 'url', os.listdir(os.path.join(store_path, 'url'))[0])
+        self.assertLess(os.path.getsize(url_index), 100)
+
+    def test_when_file_from_url_index_removed(self):
+        _, path1 = self.save(1, 'http://url.com/a.jpg')
+        shutil.rmtree(os.path.join(self.cwd, settings.FILES_DIR_NAME, settings.MEDIA_STORE_DIR_NAME,
+                                   'content'))
+        saved, path2 = self.save(2, 'http://url.com/a.jpg')
+        self.assertTrue(saved)
+        self.assertEqual(2, self.mock_download.call_count)
+
+
+def multi_func(value, kwargs):
+    if value == 'error':
+        raise ValueError
+    if value == 'exit':
+        raise SystemExit
+    return value * kwargs['factor']
+
+
+class MultiTest(unittest.TestCase):
+    def test_if_results_reported_to_on_result(self):
+        reported = []
+        multi = Multi(2, multi_func, on_result=reported.extend, factor=2)
+        with multi as mlt:
+            for value in (1, 2, 'error', 3):
+                mlt.put(value)
+        multi.join()
+        self.assertEqual([(1, 2), (2, 4), (3, 6), ('error', False)], sorted(
+            reported, key=lambda x: str(x[0])))
+        self.assertFalse(any(thread.is_alive() for thread in multi.threads))
+
+    def test_when_func_raises_system_exit_check_if_threads_keep_working(self):
+        reported = []
+        multi = Multi(2, multi_func, on_result=reported.extend, queue_size=1, factor=2)
+        with multi as mlt:
+            for value in ['exit'] * 10 + [5]:
+                mlt.put(value)
+        multi.join()
+        self.assertEqual([(5, 10)] + [('exit', False)] * 10, sorted(
+            reported, key=lambda x: str(x[0])))
+
+
+class HostLimitTest(unittest.TestCase):
+    @patch('taktyk.save.settings.DOWNLOAD_PER_HOST', 2)
+    def test_if_concurrent_downloads_per_host_limited(self):
+        lock = threading.Lock()
+        running = []
+        max_running = []
+
+        def download(url):
+            host = url.split('/')[2]
+            with host_limit(url):
+                with lock:
+                    running.append(host)
+                    max_running.append(running.count(host))
+                time.sleep(0.01)
+                with lock:
+                    running.remove(host)
+
+        urls = ['http://limited.host/{}'.format(i) for i in range(6)] + ['http://other.host/1'] * 2
+        threads = [threading.Thread(target=download, args=(url,)) for url in urls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(2, max(max_running))
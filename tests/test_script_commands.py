@@ -70,6 +70,9 @@ class DBHandlerTest(unittest.TestCase):
         patcher = patch('taktyk.commands.script_commands.database_list')
         self.mock_db_list = patcher.start()
         self.addCleanup(patcher.stop)
+        patcher_migrate = patch('taktyk.commands.script_commands.DB.migrate')
+        self.mock_migrate = patcher_migrate.start()
+        self.addCleanup(patcher_migrate.stop)
         self.mock_db_list.return_value = []
         self.dbh = DBHandler()
 
@@ -93,3 +96,9 @@ class DBHandlerTest(unittest.TestCase):
         self.dbh.db_len = 2
         self.dbh.execute()
         self.assertTrue(mock_choose.called)
+
+    def test_execute_if_migrate_called(self):
+        self.dbh.db_list = ['test_db.db']
+        self.dbh.db_len = 1
+        self.dbh.execute()
+        self.assertTrue(self.mock_migrate.called)
@@ -8,7 +8,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(os.path.abspath
 from taktyk import settings
 from taktyk.commands.user_commands import NewCommand, PdkCommand, SeleniumCommand, SessionCommand, \
     FileSourceCommand, HtmlCommand, IdsCommand, ScrapeCommand, SkipCommand, NsfwCommand, \
-    CommentsCommand
+    CommentsCommand, PagesCommand
 from taktyk.entrygenerators import ScrapeMethod
 from taktyk.strategies import SeleniumStrategy, SessionStrategy, SourceStrategy, APIStrategy
 
@@ -140,6 +140,16 @@ class ScrapeCommandTest(unittest.TestCase):
         self.assertEqual(settings.METHOD, ScrapeMethod)
 
 
+class PagesCommandTest(unittest.TestCase):
+    def test_name(self):
+        self.assertEqual('pages', PagesCommand.name)
+
+    def test_execute(self):
+        PagesCommand().execute(250)
+        self.assertEqual(250, settings.HTML_PAGE_SIZE)
+        settings.HTML_PAGE_SIZE = 0
+
+
 class IdsCommandTest(unittest.TestCase):
     def test_name(self):
         self.assertEqual('ids', IdsCommand.name)
@@ -1,12 +1,13 @@
 import os
 import sys
+import threading
 import unittest
 from unittest.mock import patch, Mock
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(os.path.abspath(__file__)))))
 
 from taktyk import settings
-from taktyk.utils import Decision, ConfigFile
+from taktyk.utils import Decision, ConfigFile, gen_prefetched
 
 
 class DecisionTest(unittest.TestCase):
@@ -125,3 +126,62 @@ class ConfigFileTest(unittest.TestCase):
         self.config.set_up()
         self.assertEqual(['.jpg'], settings.EXTS)
         self.cleanup()
+
+
+class GenPrefetchedTest(unittest.TestCase):
+    def test_if_items_yielded_in_order(self):
+        self.assertEqual(list(range(50)), list(gen_prefetched(range(50), 3)))
+
+    def test_if_iterated_in_other_thread(self):
+        threads = set()
+
+        def gen():
+            for num in range(3):
+                threads.add(threading.current_thread())
+                yield num
+
+        list(gen_prefetched(gen(), 1))
+        self.assertNotIn(threading.current_thread(), threads)
+        self.assertEqual(1, len(threads))
+
+    def test_if_producer_not_more_than_maxsize_ahead(self):
+        produced = []
+        ahead = []
+
+        def gen():
+            for num in range(20):
+                produced.append(num)
+                yield num
+
+        for num in gen_prefetched(gen(), 2):
+            threading.Event().wait(0.01)  # let producer fill the queue
+            ahead.append(len(produced) - num - 1)
+        self.assertLessEqual(max(ahead), 3)  # 2 in queue and 1 waiting for free slot
+
+    def test_if_exception_raised_in_consumer(self):
+        def gen():
+            yield 1
+            raise SystemExit
+
+        result = []
+        with self.assertRaises(SystemExit):
+            for item in gen_prefetched(gen(), 5):
+                result.append(item)
+        self.assertEqual([1], result)
+
+    def test_if_producer_stopped_and_closed_when_consumer_stops(self):
+        closed = threading.Event()
+
+        def gen():
+            try:
+                num = 0
+                while True:
+                    yield num
+                    num += 1
+            finally:
+                closed.set()
+
+        prefetched = gen_prefetched(gen(), 2)
+        self.assertEqual(0, next(prefetched))
+        prefetched.close()
+        self.assertTrue(closed.wait(5))